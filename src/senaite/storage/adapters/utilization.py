@@ -18,12 +18,48 @@
 # Copyright 2019-2022 by it's authors.
 # Some rights reserved, see README and LICENSE.
 
+from Acquisition import aq_base
 from bika.lims import api
+from senaite.storage.buffer import flush_layout_buffer
+from senaite.storage.cache import LRUCache
 from senaite.storage.catalog import STORAGE_CATALOG
+from senaite.storage.config import UTILIZATION_CACHE_SIZE
+from senaite.storage.interfaces import IStorageLayoutContainer
 from senaite.storage.interfaces import IStorageSamplesContainer
 from senaite.storage.interfaces import IStorageUtilization
+from senaite.storage.rollup import get_usage_rollup
+from senaite.storage.rollup import is_rollup_node
+from senaite.storage.rollup import UsageRollup
 from zope.interface import implementer
 
+# Utilization figures of containers, shared across requests
+_utilization_cache = LRUCache(UTILIZATION_CACHE_SIZE)
+
+
+def get_utilization_cache_stats():
+    """Returns the hits, misses and entries of the utilization cache
+    """
+    return _utilization_cache.get_stats()
+
+
+def reset_utilization_cache():
+    """Removes all entries from the utilization cache and resets its stats
+    """
+    _utilization_cache.clear()
+
+
+def invalidate_utilization(container):
+    """Increases the revision of the layout of the container passed in and of
+    the containers it is in, so their cached utilization figures are computed
+    again, and queues their reindex, so their metadata is refreshed. Used when
+    containers within are added, moved, removed, activated or deactivated,
+    that changes the figures without changing the layouts
+    """
+    while IStorageLayoutContainer.providedBy(container):
+        container.get_layout().touch()
+        container.reindex_layout()
+        container = api.get_parent(container)
+
 
 @implementer(IStorageUtilization)
 class StorageUtilization(object):
@@ -31,39 +67,107 @@ class StorageUtilization(object):
     def __init__(self, context):
         self.context = context
 
+    def get_rollup(self):
+        """Returns the usage rollup of the context if it is a facility or a
+        storage position, with the pending changes of the transaction applied.
+        If the context has no rollup yet, an empty rollup that is not stored is
+        returned, so reading does not write
+        """
+        if not is_rollup_node(self.context):
+            return None
+        flush_layout_buffer()
+        rollup = get_usage_rollup(self.context, create=False)
+        if rollup is None:
+            return UsageRollup()
+        return rollup
+
+    def get_cache_key(self):
+        """Returns the key the utilization figures of the context are cached
+        with, made of its uid and the serials of the container, its samples
+        usage totals and its revision, so it changes whenever any of them is
+        modified. Returns None if the figures cannot be cached
+        """
+        if not IStorageLayoutContainer.providedBy(self.context):
+            return None
+        flush_layout_buffer()
+        serials = self.context.get_layout().get_usage_serials()
+        container = aq_base(self.context)
+        container._p_activate()
+        if not serials or container._p_jar is None or container._p_changed:
+            return None
+        return (api.get_uid(self.context), container._p_serial) + serials
+
+    def get_utilization(self):
+        """Returns a tuple (containers, samples capacity, samples utilization)
+        with the figures of the active samples containers within the context,
+        computed from their catalog metadata or taken from the cache
+        """
+        key = self.get_cache_key()
+        figures = key and _utilization_cache.get(key)
+        if figures:
+            return figures
+        brains = self.get_layout_containers_brains()
+        figures = (
+            len(brains),
+            sum(map(lambda brain: brain.samples_capacity or 0, brains)),
+            sum(map(lambda brain: brain.samples_utilization or 0, brains)),
+        )
+        if key:
+            _utilization_cache.set(key, figures)
+        return figures
+
     def get_capacity(self):
         """Returns the total number of containers
         """
-        return len(self.get_layout_containers())
+        rollup = self.get_rollup()
+        if rollup is not None:
+            return rollup.get_samples_containers()
+        if IStorageSamplesContainer.providedBy(self.context):
+            return 1
+        return self.get_utilization()[0]
 
     def get_available_positions(self):
         """Returns the number of available containers
         """
         return self.get_capacity()
 
-    def get_layout_containers(self):
-        """Returns the contained containers
+    def get_layout_containers_brains(self):
+        """Returns the catalog brains of the active samples containers within
+        the context, including itself
         """
-        # return immediately if the container is a
-        if IStorageSamplesContainer.providedBy(self.context):
-            return [self.context]
         query = {
+            "portal_type": "StorageSamplesContainer",
             "review_state": "active",
             "path": {
                 "query": api.get_path(self.context),
             }}
-        brains = api.search(query, STORAGE_CATALOG)
-        objs = map(api.get_object, brains)
-        return filter(lambda o: IStorageSamplesContainer.providedBy(o), objs)
+        return api.search(query, STORAGE_CATALOG)
+
+    def get_layout_containers(self):
+        """Returns the contained containers
+        """
+        # return immediately if the container is a
+        if IStorageSamplesContainer.providedBy(self.context):
+            return [self.context]
+        brains = self.get_layout_containers_brains()
+        return map(api.get_object, brains)
 
     def get_samples_capacity(self):
         """Returns the total sample capacity
         """
-        containers = self.get_layout_containers()
-        return sum(map(lambda con: con.get_samples_capacity(), containers))
+        rollup = self.get_rollup()
+        if rollup is not None:
+            return rollup.get_samples_capacity()
+        if IStorageSamplesContainer.providedBy(self.context):
+            return self.context.get_samples_capacity()
+        return self.get_utilization()[1]
 
     def get_samples_utilization(self):
         """Returns the total number of samples
         """
-        containers = self.get_layout_containers()
-        return sum(map(lambda con: con.get_samples_utilization(), containers))
+        rollup = self.get_rollup()
+        if rollup is not None:
+            return rollup.get_samples_utilization()
+        if IStorageSamplesContainer.providedBy(self.context):
+            return self.context.get_samples_utilization()
+        return self.get_utilization()[2]
@@ -22,6 +22,13 @@ from bika.lims import api
 from senaite.storage import logger
 from senaite.storage.catalog import STORAGE_CATALOG
 from senaite.storage.config import STORAGE_WORKFLOW_ID
+from senaite.storage.interfaces import ISampleLocations
+from senaite.storage.interfaces import IStorageRootFolder
+from senaite.storage.layout import get_position_labels
+from zope.component import queryUtility
+
+# Separator of the segments of a storage address
+ADDRESS_SEPARATOR = "/"
 
 
 def remove_sample_from_container(sample):
@@ -36,12 +43,31 @@ def remove_sample_from_container(sample):
             api.get_id(sample)))
 
 
+def get_sample_locations():
+    """Returns the utility that keeps the location of the stored samples
+    """
+    return queryUtility(ISampleLocations)
+
+
 def get_storage_sample(sample, as_brain=False):
     """Returns the storage container of the sample
     """
-    query = dict(portal_type="StorageSamplesContainer",
-                 get_samples_uids=[api.get_uid(sample)])
-    brains = api.search(query, STORAGE_CATALOG)
+    locations = get_sample_locations()
+    if locations is None:
+        # Locations not indexed yet
+        query = dict(portal_type="StorageSamplesContainer",
+                     get_samples_uids=[api.get_uid(sample)])
+        brains = api.search(query, STORAGE_CATALOG)
+    else:
+        location = locations.get(api.get_uid(sample))
+        if not location:
+            return None
+        if not as_brain:
+            # Resolve the container by path to save the catalog search
+            container = get_location_container(location)
+            if container is not None:
+                return container
+        brains = api.search(dict(UID=location[0]), STORAGE_CATALOG)
     if not brains:
         return None
     if as_brain:
@@ -49,6 +75,61 @@ def get_storage_sample(sample, as_brain=False):
     return api.get_object(brains[0])
 
 
+def get_location_container(location):
+    """Returns the container of the sample location passed in by traversing
+    to its path, or None if the location has no path or the container is no
+    longer there
+    """
+    path = len(location) > 3 and location[3]
+    if not path:
+        return None
+    portal = api.get_portal()
+    container = portal.unrestrictedTraverse(path, None)
+    if container is None or api.get_uid(container) != location[0]:
+        return None
+    return container
+
+
+def get_free_containers_query(min_free=1, max_fill_ratio=None,
+                              sample_type=None,
+                              portal_type="StorageSamplesContainer",
+                              sort_on="fill_ratio", sort_order="descending"):
+    """Returns the catalog query for the active containers with at least the
+    given number of free positions and, optionally, filled up to the given
+    ratio at most and already holding samples of the given sample type. By
+    default, the fullest containers come first
+    """
+    query = {
+        "portal_type": portal_type,
+        "review_state": "active",
+        "free_positions": {"query": min_free, "range": "min"},
+        "sort_on": sort_on,
+        "sort_order": sort_order,
+    }
+    if max_fill_ratio is not None:
+        query["fill_ratio"] = {"query": max_fill_ratio, "range": "max"}
+    if sample_type is not None:
+        query["get_sample_types_uids"] = api.get_uid(sample_type)
+    return query
+
+
+def search_free_containers(min_free=1, **kwargs):
+    """Returns the brains of the active containers with at least the given
+    number of free positions. See get_free_containers_query
+    """
+    query = get_free_containers_query(min_free=min_free, **kwargs)
+    return api.search(query, STORAGE_CATALOG)
+
+
+def search_sample_type_containers(sample_type, min_free=1, **kwargs):
+    """Returns the brains of the active samples containers that hold samples
+    of the given sample type and have at least the given number of free
+    positions, the fullest first
+    """
+    return search_free_containers(min_free=min_free, sample_type=sample_type,
+                                  **kwargs)
+
+
 def get_storage_catalog():
     """Returns the storage catalog
     """
@@ -74,3 +155,198 @@ def get_parents(obj, parents=None, predicate=None):
     if predicate(parent):
         return parents
     return get_parents(parent, parents=parents, predicate=predicate)
+
+
+def get_address_chain(obj):
+    """Returns the list of storage contents from the facility down to the
+    object passed in, the object included
+    """
+    def is_top(parent):
+        return IStorageRootFolder.providedBy(parent) or api.is_portal(parent)
+
+    if is_top(obj):
+        return []
+    parents = get_parents(obj, predicate=is_top)[:-1]
+    return list(reversed(parents)) + [obj]
+
+
+def normalize_address_segment(segment):
+    """Returns the segment of a storage address in lowercase and with single
+    whitespaces, so it can be compared regardless of the case and spacing
+    """
+    segment = api.safe_unicode(segment or "").lower()
+    return u" ".join(segment.split()).encode("utf-8")
+
+
+def split_storage_address(address):
+    """Returns the normalized segments of the storage address passed in
+    """
+    segments = (address or "").split(ADDRESS_SEPARATOR)
+    segments = map(normalize_address_segment, segments)
+    return filter(None, segments)
+
+
+def get_address_segments(brain_or_object):
+    """Returns the normalized segments the storage content can be addressed
+    with at its level: the id, the title and the title followed by the id
+    """
+    obj_id = api.get_id(brain_or_object)
+    title = api.get_title(brain_or_object)
+    segments = (obj_id, title, u"{} {}".format(
+        api.safe_unicode(title), api.safe_unicode(obj_id)))
+    return map(normalize_address_segment, segments)
+
+
+def get_storage_address_tokens(obj):
+    """Returns the tokens the storage address of the object is indexed with.
+    For each level of the address, the id, the title and the title followed by
+    the id of the storage content at that level are indexed, so any of them
+    can be used in the address. The object is also indexed with the length of
+    the addresses it is either the last or the second to last segment of, so
+    a container and its direct children are found with the same search
+    """
+    chain = get_address_chain(obj)
+    if not chain:
+        return []
+    depth = len(chain)
+    tokens = set(["depth:{}".format(depth),
+                  "tail:{}".format(depth),
+                  "tail:{}".format(depth + 1)])
+    for level, item in enumerate(chain):
+        for segment in get_address_segments(item):
+            tokens.add("{}:{}".format(level, segment))
+    return sorted(tokens)
+
+
+def update_storage_addresses(obj):
+    """Reindexes the storage address of the storage contents within the object
+    passed in, if its title changed. The title the contents are indexed with
+    is read from the index data of a direct child, so nothing is searched nor
+    loaded if the title did not change. Returns the number of contents
+    reindexed
+    """
+    level = len(get_address_chain(obj)) - 1
+    if level < 0:
+        return 0
+    path = api.get_path(obj)
+    query = {"path": {"query": path, "depth": 1}, "sort_limit": 1}
+    children = api.search(query, STORAGE_CATALOG)[:1]
+    if not children:
+        return 0
+    catalog = api.get_tool(STORAGE_CATALOG)
+    data = catalog.getIndexDataForRID(children[0].getRID())
+    indexed = data.get("get_address_tokens") or []
+    tokens = map(lambda segment: "{}:{}".format(level, segment),
+                 get_address_segments(obj))
+    if set(tokens).issubset(indexed):
+        return 0
+
+    query = {"path": {"query": path, "depth": -1}}
+    brains = filter(lambda brain: brain.getPath() != path,
+                    api.search(query, STORAGE_CATALOG))
+    for brain in brains:
+        content = api.get_object(brain)
+        content.reindexObject(idxs=["get_address_tokens"])
+    return len(brains)
+
+
+def search_storage_address(segments):
+    """Returns the brains of the storage contents an address with the
+    normalized segments passed in can stand for: the contents whose address
+    matches with all the segments but the last one, and their direct children
+    """
+    tokens = map(lambda item: "{}:{}".format(*item), enumerate(segments[:-1]))
+    tokens.append("tail:{}".format(len(segments)))
+    query = {"get_address_tokens": {"query": tokens, "operator": "and"}}
+    return api.search(query, STORAGE_CATALOG)
+
+
+def get_address_position(brain, segment):
+    """Returns the position (row, column) the segment of an address stands for
+    within the container of the brain passed in, or None. The dimensions of
+    the container are read from the catalog metadata, so it is not loaded
+    """
+    rows = api.to_int(brain.getRows, default=0)
+    columns = api.to_int(brain.getColumns, default=0)
+    if not rows or not columns:
+        return None
+    position = get_position_labels(rows, columns).to_position(segment)
+    if not position:
+        return None
+    row, column = position
+    if 0 <= row < rows and 0 <= column < columns:
+        return position
+    return None
+
+
+def resolve_storage_address(address):
+    """Resolves a storage address like "Freezer 2 / Rack 12 / Box 45 / B07"
+    to a tuple (uid, position). Each segment of the address is either the id,
+    the title or the title followed by the id of the storage content at that
+    level. If the last segment is a position within a container, the position
+    is returned as a tuple (row, column), otherwise it is None. Returns None if
+    the address cannot be resolved or is ambiguous.
+
+    Segments are separated by a slash, so titles that contain a slash cannot
+    be used in addresses. The id of the storage content is used instead, as
+    get_storage_address does. The address is resolved with a single search
+    and no object is loaded
+    """
+    segments = split_storage_address(address)
+    if not segments:
+        return None
+
+    brains = search_storage_address(segments)
+    contents = brains
+    if len(segments) > 1 and brains:
+        # The shallowest contents found are the containers the last segment
+        # may be a position of, the others are their children
+        depths = map(lambda brain: len(brain.getPath().split("/")), brains)
+        level = min(depths)
+        containers = [brain for brain, depth in zip(brains, depths)
+                      if depth == level]
+        contents = [brain for brain, depth in zip(brains, depths)
+                    if depth > level]
+        positions = []
+        for brain in containers:
+            position = get_address_position(brain, segments[-1])
+            if position:
+                positions.append((api.get_uid(brain), position))
+        if len(positions) > 1:
+            logger.warn("Storage address '{}' is ambiguous"
+                        .format(" / ".join(segments)))
+            return None
+        if positions:
+            return positions[0]
+
+    matches = filter(lambda brain: segments[-1] in get_address_segments(
+        brain), contents)
+    if len(matches) > 1:
+        logger.warn("Storage address '{}' is ambiguous"
+                    .format(" / ".join(segments)))
+        return None
+    if not matches:
+        return None
+    return api.get_uid(matches[0]), None
+
+
+def get_storage_address(brain_or_object, row=None, column=None,
+                        use_ids=False):
+    """Returns the storage address of the object passed in. If a row and
+    column are passed in, the address of the position within the object is
+    returned. The address is made of titles, unless use_ids is True. The id
+    is used as well for the contents whose title contains the separator
+    """
+    def get_segment(item):
+        title = api.get_title(item)
+        if use_ids or ADDRESS_SEPARATOR in title:
+            return api.get_id(item)
+        return title
+
+    obj = api.get_object(brain_or_object)
+    segments = map(get_segment, get_address_chain(obj))
+    if row is not None and column is not None:
+        segments.append(obj.position_to_alpha(row, column))
+    segments = map(api.safe_unicode, segments)
+    separator = u" {} ".format(ADDRESS_SEPARATOR)
+    return separator.join(segments).encode("utf-8")
@@ -194,6 +194,9 @@ class StoreContainerView(BaseView):
 
             # Store
             position = container.alpha_to_position(alpha_position)
+            if not position:
+                message = _("No position or not valid sample selected")
+                return self.redirect(message=message)
             if container.add_object_at(sample, position[0], position[1]):
                 message = _("Stored sample {} at position {}").format(
                     api.get_id(sample), alpha_position)
@@ -18,11 +18,15 @@
 # Copyright 2019-2022 by it's authors.
 # Some rights reserved, see README and LICENSE.
 
+import collections
+import json
+
 from bika.lims import api
 from bika.lims import bikaMessageFactory as _
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from senaite.storage import logger
 from senaite.storage import senaiteMessageFactory as _s
+from senaite.storage.api import get_free_containers_query
 from senaite.storage.browser import BaseView
 
 
@@ -58,7 +62,10 @@ class StoreSamplesView(BaseView):
 
         # Handle store
         if form_submitted and form_store:
-            samples = []
+            # Placements grouped by container, so each container gets all its
+            # samples stored at once
+            containers = {}
+            placements = collections.OrderedDict()
             for sample in form.get("samples", []):
                 sample_uid = sample.get("uid")
                 container_uid = sample.get("container_uid")
@@ -70,13 +77,21 @@ class StoreSamplesView(BaseView):
                 container = self.get_object_by_uid(container_uid)
                 logger.info("Storing sample {} in {}".format(sample_obj.getId(),
                                                              container.getId()))
-                # Store
                 position = container.alpha_to_position(alpha_position)
-                stored = container.add_object_at(sample_obj, position[0],
-                                                 position[1])
-                if stored:
-                    stored = container.get_object_at(position[0], position[1])
-                    samples.append(stored)
+                if not position:
+                    continue
+                containers[container_uid] = container
+                placements.setdefault(container_uid, []).append(
+                    (sample_obj, position[0], position[1]))
+
+            # Store
+            samples = []
+            for container_uid, container_placements in placements.items():
+                container = containers[container_uid]
+                results = container.add_objects_at(container_placements)
+                for placement, stored in zip(container_placements, results):
+                    if stored:
+                        samples.append(placement[0])
 
             message = _s("Stored {} samples: {}".format(
                 len(samples), ", ".join(map(api.get_title, samples))))
@@ -102,3 +117,11 @@ class StoreSamplesView(BaseView):
                 "url": api.get_url(obj),
                 "sample_type": api.get_title(obj.getSampleType())
             }
+
+    def get_containers_base_query(self):
+        """Returns the base query of the samples containers search, as json.
+        Containers with free positions only, the fullest first
+        """
+        query = get_free_containers_query(min_free=1)
+        query["limit"] = "30"
+        return json.dumps(query)
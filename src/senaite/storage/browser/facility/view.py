@@ -23,9 +23,8 @@ import collections
 from bika.lims import api
 from bika.lims.utils import get_link_for
 from senaite.storage import senaiteMessageFactory as _
-from senaite.storage.api import get_parents
 from senaite.storage.browser.storage.listing import StorageListing
-from senaite.storage.interfaces import IStorageFacility
+from senaite.storage.catalog import STORAGE_CATALOG
 from senaite.storage.permissions import AddStorageContainer
 from senaite.storage.permissions import AddStoragePosition
 
@@ -53,6 +52,9 @@ class FacilityListingView(StorageListing):
 
         self.form_id = "facility_listing"
 
+        # Brains of the parents of the rows, by UID
+        self.parents = {}
+
         self.context_actions = collections.OrderedDict((
             (_("Add storage position"), {
                 "url": "++add++StoragePosition",
@@ -115,9 +117,49 @@ class FacilityListingView(StorageListing):
         being rendered as a row in the list
         """
         item = super(FacilityListingView, self).folderitem(obj, item, index)
-        obj = api.get_object(obj)
-        parents = get_parents(
-            obj, predicate=lambda o: IStorageFacility.providedBy(o))
+        parents = self.get_parents_brains(obj)
         item["replace"]["Position"] = " » ".join(
             map(get_link_for, reversed(parents)))
         return item
+
+    def _fetch_brains(self, idxfrom=0):
+        brains = super(FacilityListingView, self)._fetch_brains(idxfrom)
+        self.fetch_parents_brains(brains)
+        return brains
+
+    def fetch_parents_brains(self, brains):
+        """Looks up the brains of the parents of the brains passed in, up to
+        the facility, with a single search per level of depth, and keeps them
+        for the rows to be rendered
+        """
+        uids = set(map(lambda brain: brain.get_parent_uid, brains))
+        while uids:
+            uids = filter(None, uids.difference(self.parents))
+            if not uids:
+                break
+            parents = api.search({"UID": uids}, STORAGE_CATALOG)
+            uids = set()
+            for parent in parents:
+                self.parents[api.get_uid(parent)] = parent
+                if api.get_portal_type(parent) != "StorageFacility":
+                    uids.add(parent.get_parent_uid)
+
+    def get_parents_brains(self, brain):
+        """Returns the brains of the parents of the brain passed in, up to the
+        facility, from the closest to the farthest. Parents are looked up by
+        the parent UID metadata, most of them in advance for the whole batch
+        """
+        parents = []
+        parent_uid = brain.get_parent_uid
+        while parent_uid:
+            parent = self.parents.get(parent_uid)
+            if parent is None:
+                brains = api.search({"UID": parent_uid}, STORAGE_CATALOG)
+                if not brains:
+                    break
+                parent = self.parents[parent_uid] = brains[0]
+            parents.append(parent)
+            if api.get_portal_type(parent) == "StorageFacility":
+                break
+            parent_uid = parent.get_parent_uid
+        return parents
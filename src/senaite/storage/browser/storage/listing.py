@@ -27,7 +27,6 @@ from bika.lims.utils import get_progress_bar_html
 from senaite.app.listing import ListingView
 from senaite.storage import senaiteMessageFactory as _
 from senaite.storage.catalog import STORAGE_CATALOG
-from senaite.storage.interfaces import IStorageUtilization
 
 
 class StorageListing(ListingView):
@@ -97,7 +96,6 @@ class StorageListing(ListingView):
         """
         item = super(StorageListing, self).folderitem(obj, item, index)
 
-        obj = api.get_object(obj)
         icon = api.get_icon(obj)
         level = self.get_child_level(obj)
         link = get_link_for(obj)
@@ -108,9 +106,7 @@ class StorageListing(ListingView):
         item["node_level"] = level
 
         # Samples usage
-        utilization = IStorageUtilization(obj)
-        capacity = utilization.get_samples_capacity()
-        samples = utilization.get_samples_utilization()
+        capacity, samples = self.get_samples_usage(obj)
         percentage = capacity and samples*100/capacity or 0
         item["replace"]["SamplesUsage"] = self.get_usage_bar_html(percentage)
         item["replace"]["Samples"] = "{:01d} / {:01d} ({:01d}%)"\
@@ -123,12 +119,20 @@ class StorageListing(ListingView):
 
         return item
 
+    def get_samples_usage(self, brain):
+        """Returns a tuple (samples capacity, samples utilization) of the
+        storage content of the brain, read from the catalog metadata without
+        loading the object
+        """
+        return (brain.samples_capacity or 0, brain.samples_utilization or 0)
+
     def get_child_level(self, obj):
-        if obj == self.context:
+        """Returns the level of the object within the context, computed from
+        their paths. Direct children of the context are at level 0
+        """
+        context_path = api.get_path(self.context)
+        path = api.get_path(obj)
+        if path == context_path:
             return 0
-        level = 0
-        parent = api.get_parent(obj)
-        while parent != self.context:
-            level += 1
-            parent = api.get_parent(parent)
-        return level
+        level = len(path.split("/")) - len(context_path.split("/")) - 1
+        return max(level, 0)
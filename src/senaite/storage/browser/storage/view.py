@@ -23,7 +23,6 @@ import collections
 from bika.lims import api
 from senaite.storage import senaiteMessageFactory as _
 from senaite.storage.browser.storage.listing import StorageListing
-from senaite.storage.interfaces import IStorageUtilization
 from senaite.storage.permissions import AddStorageFacility
 
 
@@ -104,10 +103,8 @@ class StorageListingView(StorageListing):
         being rendered as a row in the list
         """
         item = super(StorageListingView, self).folderitem(obj, item, index)
-        obj = api.get_object(obj)
         # Containers
-        utilization = IStorageUtilization(obj)
-        containers = utilization.get_layout_containers()
-        item["replace"]["Containers"] = "{:01d}".format(len(containers))
+        containers = obj.samples_containers or 0
+        item["replace"]["Containers"] = "{:01d}".format(containers)
 
         return item
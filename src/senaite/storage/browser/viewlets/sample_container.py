@@ -23,7 +23,9 @@ from bika.lims import workflow as wf
 from bika.lims.browser import ulocalized_time
 from plone.app.layout.viewlets import ViewletBase
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
-from senaite.storage.catalog import STORAGE_CATALOG
+from senaite.storage.api import get_sample_locations
+from senaite.storage.api import get_storage_sample
+from senaite.storage.layout import get_position_labels
 
 
 class SampleContainerViewlet(ViewletBase):
@@ -47,26 +49,35 @@ class SampleContainerViewlet(ViewletBase):
         """Returns the storage container this Sample is stored in
         """
         # Search the container the sample is stored in
-        query = {"portal_type": "StorageSamplesContainer",
-                 "get_samples_uids": api.get_uid(self.context)}
-        brains = api.search(query, STORAGE_CATALOG)
-        if not brains:
+        brain = get_storage_sample(self.context, as_brain=True)
+        if not brain:
             return None
 
-        # Get the data info from the container
-        container = api.get_object(brains[0])
-        position = container.get_object_position(self.context)
-        position = container.position_to_alpha(position[0], position[1])
+        # Get the data info from the container metadata
+        position = self.get_sample_position(brain)
         return {
-            "uid": api.get_uid(container),
-            "id": api.get_id(container),
-            "title": api.get_title(container),
-            "url": api.get_url(container),
+            "uid": api.get_uid(brain),
+            "id": api.get_id(brain),
+            "title": api.get_title(brain),
+            "url": api.get_url(brain),
             "position": position,
-            "full_title": container.get_full_title(),
+            "full_title": brain.get_full_title,
             "when": wf.getTransitionDate(self.context, "store"),
         }
 
+    def get_sample_position(self, brain):
+        """Returns the position of the sample within the container of the
+        brain passed in, in alphanumeric format
+        """
+        locations = get_sample_locations()
+        location = locations and locations.get(api.get_uid(self.context))
+        if not location or not brain.getRows or not brain.getColumns:
+            container = api.get_object(brain)
+            position = container.get_object_position(self.context)
+            return container.position_to_alpha(position[0], position[1])
+        labels = get_position_labels(brain.getRows, brain.getColumns)
+        return labels.to_alpha(location[1], location[2])
+
     def index(self):
         if self.is_stored():
             return ""
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.STORAGE.
+#
+# SENAITE.STORAGE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2019-2022 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import collections
+import heapq
+import itertools
+import threading
+
+import transaction
+from Acquisition import aq_base
+from bika.lims import api
+from senaite.storage import logger
+from Testing.makerequest import makerequest
+from ZODB.POSException import ConflictError
+from zope.component.hooks import getSite
+from zope.component.hooks import setSite
+
+# Number of attempts to commit the reindex deferred after a commit
+DEFERRED_REINDEX_ATTEMPTS = 3
+
+_local = threading.local()
+
+
+def get_layout_buffer():
+    """Returns the layout write buffer of the current transaction
+    """
+    txn = transaction.get()
+    layout_buffer = getattr(_local, "layout_buffer", None)
+    if layout_buffer is None or layout_buffer.transaction is not txn:
+        layout_buffer = LayoutWriteBuffer(txn)
+        _local.layout_buffer = layout_buffer
+    return layout_buffer
+
+
+def queue_reindex(obj, idxs, deferred=False):
+    """Queues the reindex of the indexes passed in for the object. The indexes
+    queued for each object are reindexed together, once, right before the
+    transaction is committed. If deferred is True, they are reindexed right
+    after the transaction is committed instead, in a transaction of its own,
+    so concurrent transactions that write the same object do not conflict on
+    its catalog record
+    """
+    get_layout_buffer().mark_reindex(obj, idxs, deferred=deferred)
+
+
+def reindex_committed(db, site_path, entries,
+                      attempts=DEFERRED_REINDEX_ATTEMPTS):
+    """Reindexes the indexes of the objects passed in as a list of tuples
+    (path, idxs), with a connection and a transaction of their own. The
+    transaction is retried on conflicts, with the objects read again. Returns
+    whether the reindex was committed
+    """
+    tm = transaction.TransactionManager()
+    connection = db.open(transaction_manager=tm)
+    site = getSite()
+    try:
+        for attempt in range(attempts):
+            tm.begin()
+            app = makerequest(connection.root()["Application"])
+            setSite(app.unrestrictedTraverse(site_path))
+            try:
+                for path, idxs in entries:
+                    obj = app.unrestrictedTraverse(path, None)
+                    if obj is not None:
+                        obj.reindexObject(idxs=idxs)
+                tm.commit()
+                return True
+            except ConflictError:
+                tm.abort()
+        logger.warn("Cannot reindex {} objects after commit, run the "
+                    "consistency check to repair the index"
+                    .format(len(entries)))
+        return False
+    finally:
+        tm.abort()
+        connection.close()
+        setSite(site)
+
+
+def flush_layout_buffer():
+    """Flushes the layout write buffer of the current transaction, if any
+    """
+    layout_buffer = getattr(_local, "layout_buffer", None)
+    if layout_buffer is None:
+        return
+    if layout_buffer.transaction is not transaction.get():
+        return
+    layout_buffer.flush()
+
+
+class LayoutWriteBuffer(object):
+    """Collects the storage layout containers whose layout changed within a
+    transaction, so their parents are updated only once, right before the
+    transaction is committed or as soon as the usage of a container is read.
+
+    Containers are processed bottom-up, deepest first, so the usage of each
+    ancestor is propagated once, after all its dirty children were processed.
+
+    The indexes the mutations of the transaction invalidate are collected as
+    well, and reindexed in a single call per object before the commit
+    """
+
+    def __init__(self, txn):
+        self.transaction = txn
+        self.containers = {}
+        self.queue = []
+        self.counter = itertools.count()
+        self.flushing = False
+        self.reindex = collections.OrderedDict()
+        txn.addBeforeCommitHook(self.before_commit)
+        txn.addAfterCommitHook(self.after_commit)
+
+    def before_commit(self):
+        """Updates the parents of the dirty containers and reindexes the
+        objects with queued indexes, but those deferred
+        """
+        self.flush()
+        self.flush_reindex(deferred=False)
+
+    def after_commit(self, success):
+        """Reindexes the objects with deferred indexes in a transaction of
+        their own, once the transaction is committed
+        """
+        entries = []
+        for obj, idxs, deferred in self.reindex.values():
+            if idxs and obj._p_jar is not None:
+                entries.append((obj, sorted(idxs)))
+        self.reindex.clear()
+        if not success or not entries:
+            return
+        db = entries[0][0]._p_jar.db()
+        site_path = api.get_path(api.get_portal())
+        entries = map(lambda entry: (api.get_path(entry[0]), entry[1]),
+                      entries)
+        reindex_committed(db, site_path, entries)
+
+    def mark_reindex(self, obj, idxs, deferred=False):
+        """Queues the reindex of the indexes passed in for the object. The
+        indexes of an object are deferred only if all of them are
+        """
+        uid = api.get_uid(obj)
+        if uid not in self.reindex:
+            self.reindex[uid] = (obj, set(), deferred)
+        entry = self.reindex[uid]
+        entry[1].update(idxs)
+        self.reindex[uid] = (obj, entry[1], entry[2] and deferred)
+
+    def get_reindex(self, obj):
+        """Returns the indexes queued for the object
+        """
+        entry = self.reindex.get(api.get_uid(obj))
+        return entry and sorted(entry[1]) or []
+
+    def flush_reindex(self, deferred=True):
+        """Reindexes the queued indexes, once per object. The deferred ones
+        are reindexed as well, unless deferred is False
+        """
+        for uid, (obj, idxs, is_deferred) in self.reindex.items():
+            if is_deferred and not deferred:
+                continue
+            del self.reindex[uid]
+            if not idxs:
+                # An empty list of indexes would reindex the whole object
+                continue
+            if not self.is_contained(obj):
+                # Removed within this same transaction
+                continue
+            obj.reindexObject(idxs=sorted(idxs))
+
+    def is_contained(self, obj):
+        """Returns whether the object is still contained in its parent
+        """
+        parent = api.get_parent(obj)
+        contained = parent._getOb(api.get_id(obj), None)
+        return aq_base(contained) is aq_base(obj)
+
+    def mark_dirty(self, container):
+        """Flags the container so its parent is updated on flush
+        """
+        uid = api.get_uid(container)
+        if uid in self.containers:
+            return
+        self.containers[uid] = container
+        depth = len(container.getPhysicalPath())
+        heapq.heappush(self.queue, (-depth, next(self.counter), uid))
+
+    def is_dirty(self, container):
+        """Returns whether the parent of the container has to be updated
+        """
+        return api.get_uid(container) in self.containers
+
+    def get_dirty(self):
+        """Returns the containers whose parent has to be updated
+        """
+        return self.containers.values()
+
+    def flush(self):
+        """Updates the parents of the dirty containers, deepest first. Parents
+        that change are flagged as dirty as well and updated within the same
+        flush, once all their dirty children were processed
+        """
+        if self.flushing:
+            return
+        self.flushing = True
+        try:
+            while self.queue:
+                depth, num, uid = heapq.heappop(self.queue)
+                container = self.containers.pop(uid, None)
+                if container is None:
+                    continue
+                container.update_parent()
+        finally:
+            self.flushing = False
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.STORAGE.
+#
+# SENAITE.STORAGE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2019-2022 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Thread-safe in-memory cache that evicts the least recently used entries
+    once it holds the maximum number of entries. The cache is shared by all
+    the threads of the process, so entries must be keyed on values that
+    change when the cached value is no longer valid
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Returns the value of the key, or default if not cached
+        """
+        with self.lock:
+            if key not in self.data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            value = self.data.pop(key)
+            self.data[key] = value
+            return value
+
+    def set(self, key, value):
+        """Caches the value for the key, evicting the least recently used
+        entry if the cache is full
+        """
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        """Removes all entries and resets the stats
+        """
+        with self.lock:
+            self.data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self):
+        """Returns a dict with the number of hits, misses and entries
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.data),
+                "size": self.size,
+            }
@@ -35,13 +35,21 @@ INDEXES = BASE_INDEXES + [
 
     # Ids of parent containers and current
     ("get_all_ids", "", "KeywordIndex"),
+    # Tokens of the storage address, to resolve addresses with one search
+    ("get_address_tokens", "", "KeywordIndex"),
     # Keeps the sample uids stored in each sample container
     ("get_samples_uids", "", "KeywordIndex"),
+    # Keeps the sample type uids of the samples stored in each sample container
+    ("get_sample_types_uids", "", "KeywordIndex"),
     # For searches, made of get_all_ids + Title
     ("listing_searchable_text", "", "ZCTextIndex"),
     # Index used in searches to filter sample containers with available slots
     ("Title", "", "FieldIndex"),
     ("is_full", "", "BooleanIndex"),
+    # Indexes used in searches for containers with room for a number of
+    # objects, sorted by how full they are
+    ("free_positions", "", "FieldIndex"),
+    ("fill_ratio", "", "FieldIndex"),
     ("sortable_title", "", "FieldIndex"),
 ]
 
@@ -50,6 +58,16 @@ COLUMNS = BASE_COLUMNS + [
     "id",
     "Title",
     "Description",
+    # Samples usage of storage contents, to render the utilization from brains
+    "samples_capacity",
+    "samples_utilization",
+    "samples_containers",
+    # Location, dimensions and free positions, to render listings from brains
+    "get_parent_uid",
+    "get_full_title",
+    "get_available_positions_count",
+    "getRows",
+    "getColumns",
 ]
 
 TYPES = [
@@ -21,3 +21,10 @@
 PRODUCT_NAME = "senaite.storage"
 PROFILE_ID = "profile-{}:default".format(PRODUCT_NAME)
 STORAGE_WORKFLOW_ID = "senaite_storage_default_workflow"
+
+# Containers with more positions than this use a sparse layout, that only keeps
+# the occupied positions
+SPARSE_LAYOUT_THRESHOLD = 1000
+
+# Maximum number of containers whose utilization figures are kept in memory
+UTILIZATION_CACHE_SIZE = 10000
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.STORAGE.
+#
+# SENAITE.STORAGE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2019-2022 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import multiprocessing
+
+from AccessControl.SecurityManagement import newSecurityManager
+from AccessControl.SpecialUsers import system
+from bika.lims import api
+from senaite.core.catalog import SAMPLE_CATALOG
+from senaite.storage import logger
+from senaite.storage.buffer import get_layout_buffer
+from senaite.storage.catalog import STORAGE_CATALOG
+from senaite.storage.interfaces import IStorageSamplesContainer
+from Testing.makerequest import makerequest
+from ZODB.interfaces import IMVCCStorage
+from zope.component.hooks import setSite
+
+# Number of containers each worker checks per task
+CHUNK_SIZE = 200
+
+# Keys of the report with the issues found, in the order they are repaired
+REPORT_KEYS = ("orphans", "not_stored", "duplicates", "index_mismatch",
+               "drift")
+
+# Portal of the worker process, with its own connection to the database
+_worker = {}
+
+# Options of the storage configuration for a persistent client cache, that are
+# disabled in worker processes (ZEO and RelStorage)
+CLIENT_CACHE_OPTIONS = ("client", "cache_local_dir")
+
+
+def get_empty_report():
+    """Returns an empty consistency report
+    """
+    report = dict.fromkeys(REPORT_KEYS)
+    for key in REPORT_KEYS:
+        report[key] = []
+    report.update({"checked": 0, "locations": {}})
+    return report
+
+
+def get_container_info(container):
+    """Returns the basic information of a container for the report
+    """
+    return {
+        "container": api.get_uid(container),
+        "path": api.get_path(container),
+    }
+
+
+def get_indexed_samples_uids(container):
+    """Returns the sample uids the storage catalog has indexed for the
+    samples container passed in
+    """
+    catalog = api.get_tool(STORAGE_CATALOG)
+    path = api.get_path(container)
+    rid = catalog.getrid(path)
+    if rid is None:
+        return []
+    data = catalog.getIndexDataForRID(rid)
+    return data.get("get_samples_uids") or []
+
+
+def check_container(container, report):
+    """Checks the consistency of the layout container passed in and adds the
+    issues found to the report
+    """
+    info = get_container_info(container)
+    report["checked"] += 1
+
+    drift = container.get_layout().get_usage_drift()
+    if drift:
+        report["drift"].append(dict(info, drift=drift))
+
+    if not IStorageSamplesContainer.providedBy(container):
+        return
+
+    uids = container.get_samples_uids()
+    for uid in uids:
+        report["locations"].setdefault(uid, []).append(info["path"])
+
+    # Samples that no longer exist or are not in stored status
+    states = {}
+    if uids:
+        brains = api.search({"UID": uids}, SAMPLE_CATALOG)
+        states = dict([(api.get_uid(brain), api.get_review_status(brain))
+                       for brain in brains])
+    for uid in uids:
+        position = list(container.get_object_position(uid))
+        if uid not in states:
+            report["orphans"].append(
+                dict(info, uid=uid, position=position))
+        elif states[uid] != "stored":
+            report["not_stored"].append(
+                dict(info, uid=uid, position=position,
+                     review_state=states[uid]))
+
+    # Samples the catalog index does not agree with
+    indexed = set(get_indexed_samples_uids(container))
+    missing = sorted(set(uids).difference(indexed))
+    extra = sorted(indexed.difference(uids))
+    if missing or extra:
+        report["index_mismatch"].append(
+            dict(info, missing=missing, extra=extra))
+
+
+def check_containers(portal, paths):
+    """Checks the layout containers with the paths passed in and returns a
+    partial report
+    """
+    report = get_empty_report()
+    for path in paths:
+        container = portal.unrestrictedTraverse(path, None)
+        if container is None:
+            continue
+        check_container(container, report)
+    return report
+
+
+def merge_reports(reports):
+    """Merges the partial reports into a single report and looks for samples
+    stored in more than one container
+    """
+    merged = get_empty_report()
+    for report in reports:
+        merged["checked"] += report["checked"]
+        for key in REPORT_KEYS:
+            merged[key].extend(report[key])
+        for uid, paths in report["locations"].items():
+            merged["locations"].setdefault(uid, []).extend(paths)
+
+    for uid, paths in sorted(merged.pop("locations").items()):
+        if len(paths) > 1:
+            merged["duplicates"].append({"uid": uid, "paths": sorted(paths)})
+
+    for key in REPORT_KEYS:
+        merged[key].sort(
+            key=lambda issue: (issue.get("path"), issue.get("uid")))
+    return merged
+
+
+def get_containers_paths(portal):
+    """Returns the paths of all the layout containers, sorted
+    """
+    query = {"portal_type": ["StorageContainer", "StorageSamplesContainer"]}
+    brains = api.search(query, STORAGE_CATALOG)
+    return sorted(map(lambda brain: brain.getPath(), brains))
+
+
+def get_read_only_database(name="main"):
+    """Opens the database with the name passed in on a read-only storage and
+    without a persistent client cache, so it cannot be written and does not
+    share the cache files of the main process. The configuration is changed
+    in place, so this is only meant for worker processes
+    """
+    from App.config import getConfiguration
+    factory = getConfiguration().dbtab.getDatabaseFactory(name=name)
+    storage = factory.config.storage.config
+    storage.read_only = True
+    for option in CLIENT_CACHE_OPTIONS:
+        if getattr(storage, option, None) is not None:
+            setattr(storage, option, None)
+    return factory.open(name, {})
+
+
+def init_worker(site_id):
+    """Opens a read-only connection to the database for the worker process,
+    so the worker cannot write anything
+    """
+    db = get_read_only_database()
+    app = makerequest(db.open().root()["Application"])
+    portal = app[site_id]
+    setSite(portal)
+    newSecurityManager(None, system)
+    _worker["portal"] = portal
+
+
+def check_chunk(paths):
+    """Checks the chunk of paths passed in, within a worker process
+    """
+    portal = _worker["portal"]
+    try:
+        return check_containers(portal, paths)
+    finally:
+        portal._p_jar.transaction_manager.abort()
+        portal._p_jar.cacheGC()
+
+
+def supports_multiple_clients(portal):
+    """Returns whether the storage of the database the portal is in can be
+    opened by other processes at the same time, as with ZEO or RelStorage
+    """
+    storage = portal._p_jar.db().storage
+    if IMVCCStorage.providedBy(storage):
+        return True
+    try:
+        from ZEO.ClientStorage import ClientStorage
+    except ImportError:
+        return False
+    return isinstance(storage, ClientStorage)
+
+
+def check_storage_consistency(portal, workers=0, chunk_size=CHUNK_SIZE):
+    """Checks that the samples stored in the layouts exist, are in stored
+    status, are stored in one container only and are indexed in the storage
+    catalog, and that the running samples usage totals did not drift.
+
+    The containers are split in chunks among the number of worker processes
+    passed in, each with its own connection to the database, what requires a
+    storage that supports multiple clients (e.g. ZEO). Otherwise, a ValueError
+    is raised. If workers is 0, the containers are checked in this process.
+    Returns the report
+    """
+    if workers and not supports_multiple_clients(portal):
+        raise ValueError("Worker processes require a storage that supports "
+                         "multiple clients (e.g. ZEO)")
+
+    paths = get_containers_paths(portal)
+    chunks = [paths[pos:pos + chunk_size]
+              for pos in range(0, len(paths), chunk_size)]
+    logger.info("Checking consistency of {} containers ({} workers) ..."
+                .format(len(paths), workers))
+
+    if not workers:
+        reports = map(lambda chunk: check_containers(portal, chunk), chunks)
+        return merge_reports(reports)
+
+    reports = []
+    pool = multiprocessing.Pool(workers, init_worker, (api.get_id(portal),))
+    try:
+        for report in pool.imap_unordered(check_chunk, chunks):
+            reports.append(report)
+            logger.info("Checking consistency: {}/{} chunks"
+                        .format(len(reports), len(chunks)))
+    finally:
+        pool.close()
+        pool.join()
+    return merge_reports(reports)
+
+
+def repair_storage_consistency(portal, report):
+    """Repairs the issues of the report that can be repaired safely: orphan
+    samples are removed from the layouts, the index of containers that do not
+    match is rebuilt and the drifted usage totals are recomputed. Samples that
+    are not stored or are stored more than once are left for manual review.
+    Returns the number of containers repaired
+    """
+    containers = {}
+    for issue in report["orphans"]:
+        container = portal.unrestrictedTraverse(issue["path"])
+        container.remove_objects([issue["uid"]])
+        containers[issue["path"]] = container
+
+    for issue in report["drift"]:
+        container = portal.unrestrictedTraverse(issue["path"])
+        container.verify_samples_usage(repair=True)
+        container.notify_parent()
+        containers[issue["path"]] = container
+
+    for issue in report["index_mismatch"]:
+        container = portal.unrestrictedTraverse(issue["path"])
+        containers[issue["path"]] = container
+
+    for container in containers.values():
+        container.reindex_layout()
+    # Reindex right away, so the repair shows up in a check done next
+    get_layout_buffer().flush_reindex()
+    logger.info("Repaired {} containers".format(len(containers)))
+    return len(containers)
@@ -18,27 +18,36 @@
 # Copyright 2019-2022 by it's authors.
 # Some rights reserved, see README and LICENSE.
 
-import re
-import string
-
+from Acquisition import aq_base
 from bika.lims import api
 from bika.lims.content.bikaschema import BikaFolderSchema
 from bika.lims.idserver import renameAfterCreation
 from plone.app.folder.folder import ATFolder
+from Products.Archetypes.Field import BooleanField
+from Products.Archetypes.Field import ComputedField
 from Products.Archetypes.Field import IntegerField
-from Products.Archetypes.Field import LinesField
 from Products.Archetypes.Schema import Schema
+from Products.Archetypes.Widget import BooleanWidget
+from Products.Archetypes.Widget import ComputedWidget
 from Products.Archetypes.Widget import IntegerWidget
-from Products.Archetypes.Widget import LinesWidget
 from Products.validation.validators.ExpressionValidator import \
     ExpressionValidator
 from senaite.core.browser.fields.records import RecordsField
 from senaite.core.browser.widgets.recordswidget import RecordsWidget
 from senaite.storage import logger
 from senaite.storage import senaiteMessageFactory as _
+from senaite.storage.buffer import flush_layout_buffer
+from senaite.storage.buffer import get_layout_buffer
+from senaite.storage.buffer import queue_reindex
+from senaite.storage.config import SPARSE_LAYOUT_THRESHOLD
 from senaite.storage.interfaces import IStorageBreadcrumbs
 from senaite.storage.interfaces import IStorageFacility
 from senaite.storage.interfaces import IStorageLayoutContainer
+from senaite.storage.interfaces import IStorageSamplesContainer
+from senaite.storage.layout import StorageLayout
+from senaite.storage.layout import get_position_labels
+from senaite.storage.rollup import is_rollup_node
+from senaite.storage.rollup import update_usage_rollups
 from zope.interface import implements
 
 Rows = IntegerField(
@@ -69,8 +78,22 @@ Columns = IntegerField(
     )
 )
 
+SparseLayout = BooleanField(
+    name="SparseLayout",
+    default=False,
+    widget=BooleanWidget(
+        label=_("Sparse layout"),
+        description=_("Only keep the occupied positions of the layout. "
+                      "Recommended for containers with a large number of "
+                      "positions. Very large containers always use a sparse "
+                      "layout")
+    ),
+)
+
 # This field is not editable and is generated automatically based on the rows,
-# columns and occupied positions. It returns a list of dicts. Each dict
+# columns and occupied positions. The layout items are not stored in the field,
+# but in a StorageLayout object that is keyed by position (see get_layout).
+# The field accessor returns a list of dicts though. Each dict
 # represents an object stored within this container at the given 'column' and
 # 'row' keys. The UID of the object is stored as a value for the key 'uid'.
 # "capacity" refers to the number of samples the contained object can store
@@ -97,11 +120,12 @@ PositionsLayout = RecordsField(
     )
 )
 
-AvailablePositions = LinesField(
+# Computed from the layout, so it does not need to be regenerated each time a
+# position is taken or released
+AvailablePositions = ComputedField(
     name="AvailablePositions",
-    required=0,
-    subfields=("row", "column"),
-    widget=LinesWidget(
+    expression="here.get_available_alpha_positions()",
+    widget=ComputedWidget(
         visible=False
     )
 )
@@ -109,6 +133,7 @@ AvailablePositions = LinesField(
 schema = BikaFolderSchema.copy() + Schema((
     Rows,
     Columns,
+    SparseLayout,
     PositionsLayout,
     AvailablePositions,
 ))
@@ -124,6 +149,9 @@ class StorageLayoutContainer(ATFolder):
     implements(IStorageLayoutContainer)
     _at_rename_after_creation = True
     schema = schema
+
+    # Indexes and metadata that change when the layout of the container changes
+    layout_indexes = ("fill_ratio", "free_positions", "is_full")
     default_samples_capacity = 0
 
     def _renameAfterCreation(self, check_auto_id=False):
@@ -159,42 +187,48 @@ class StorageLayoutContainer(ATFolder):
         self.getField('Columns').set(self, value)
         self.rebuild_layout()
 
+    def setSparseLayout(self, value):
+        self.getField('SparseLayout').set(self, value)
+        self.rebuild_layout()
+
+    def use_sparse_layout(self):
+        """Returns whether the layout of this container only keeps the occupied
+        positions. This is the case when set explicitly or when the number of
+        positions is above the sparse layout threshold
+        """
+        if self.getSparseLayout():
+            return True
+        size = self.getRows() * self.getColumns()
+        return size > SPARSE_LAYOUT_THRESHOLD
+
     def get_default_layout_item(self, row=0, column=0):
         """Returns a default item for the positions layout
         """
         return dict(row=row, column=column, uid="", samples_utilization=0,
                     samples_capacity=self.default_samples_capacity)
 
+    def get_position_labels(self):
+        """Returns the precomputed position labels for the dimensions of this
+        container
+        """
+        layout = self.get_layout()
+        return get_position_labels(layout.rows, layout.columns)
+
     def get_alpha_row(self, row):
         """Returns the alpha part for the passed in row
         """
-        alphabet = string.ascii_uppercase
-        num, idx = divmod(row, len(alphabet))
-        if num:
-            return self.get_alpha_column(num - 1) + alphabet[idx]
-        return alphabet[idx]
+        return self.get_position_labels().get_row_label(row)
 
     def position_to_alpha(self, row, column):
         """Returns a position in alphanumeric format (e.g A01)
         """
-        alpha_part = self.get_alpha_row(row)
-        lead_zeros = len(str(self.getColumns())) - 1
-        num_part = "%0{}d".format(lead_zeros) % (column + 1)
-        return "{}{}".format(alpha_part, num_part)
+        return self.get_position_labels().to_alpha(row, column)
 
     def alpha_to_position(self, alpha):
-        """Converts an alphanumeric value to a position
-        """
-        alphabet = string.ascii_uppercase
-        regex = re.compile(r"([A-Z]+)(\d+)", re.IGNORECASE)
-        matches = re.findall(regex, alpha)
-        alpha_part = matches[0][0]
-        column = api.to_int(matches[0][1]) - 1
-        row = 0
-        mapping = map(lambda val: alphabet.index(val), alpha_part)
-        for idx in range(len(mapping)):
-            row += idx * len(alphabet) + mapping[idx]
-        return (row, column)
+        """Converts an alphanumeric value to a position. Returns None if the
+        value is not a valid alphanumeric position
+        """
+        return self.get_position_labels().to_position(alpha)
 
     def get_absolute_position(self, row, column):
         """Returns the absolute position for the row and column passed in
@@ -203,23 +237,72 @@ class StorageLayoutContainer(ATFolder):
             return -1
         return row * self.getColumns() + column + 1
 
+    def get_layout(self, create=False):
+        """Returns the persistent layout that keeps the items of this container
+        by position. If the container does not have a layout yet and create is
+        False, returns a transient layout built from the PositionsLayout field
+        that is never stored. Writers must pass create=True
+        """
+        layout = getattr(aq_base(self), "_layout", None)
+        if layout is not None:
+            return layout
+        if create:
+            return self.create_layout()
+        layout = getattr(aq_base(self), "_v_layout", None)
+        if layout is None:
+            layout = self.build_layout()
+            self._v_layout = layout
+        return layout
+
+    def get_layout_snapshot(self):
+        """Returns the read-only snapshot of the layout for the current
+        transaction, shared by all read helpers
+        """
+        return self.get_layout().get_snapshot()
+
+    def build_layout(self):
+        """Returns a new layout for this container with the records stored in
+        the PositionsLayout field, if any. The layout is not stored
+        """
+        layout = StorageLayout(rows=self.getRows(),
+                               columns=self.getColumns(),
+                               default_capacity=self.default_samples_capacity,
+                               sparse=self.use_sparse_layout())
+        field = self.getField("PositionsLayout")
+        layout.update(field.get(self) or [])
+        return layout
+
+    def create_layout(self):
+        """Creates the persistent layout of this container with the records
+        stored in the PositionsLayout field, if any
+        """
+        layout = self.build_layout()
+        self._layout = layout
+        self._v_layout = None
+        # Records are kept in the layout from now on
+        self.getField("PositionsLayout").set(self, [])
+        return layout
+
     def rebuild_layout(self):
         """Rebuilds the layout with all positions
         """
-        new_layout = list()
-        for num_row in range(self.getRows()):
-            for num_col in range(self.getColumns()):
-                new_item = self.get_default_layout_item(num_row, num_col)
-                item = self.get_item_at(num_row, num_col)
-                new_item = item and item.copy() or new_item
-                new_layout.append(new_item)
-        self.getField("PositionsLayout").set(self, new_layout)
-        available = map(lambda el: self.position_to_alpha(el[0], el[1]),
-                        self.get_available_positions())
-        self.setAvailablePositions(available)
+        layout = self.get_layout(create=True)
+        sparse = self.use_sparse_layout()
+        # Switch to sparse mode before resizing and to dense mode after, so
+        # the empty positions are only added for the smaller dimensions
+        if sparse:
+            layout.set_sparse(True)
+        layout.resize(self.getRows(), self.getColumns())
+        layout.set_sparse(sparse)
+
+    def getPositionsLayout(self):
+        """Returns the list of layout items, sorted by row and column
+        """
+        flush_layout_buffer()
+        return self.get_layout_snapshot().items()
 
     def setPositionsLayout(self, values):
-        self.getField("PositionsLayout").set(self, values)
+        self.get_layout(create=True).update(values or [])
         self.rebuild_layout()
 
     def is_valid_position(self, row, column):
@@ -258,10 +341,20 @@ class StorageLayoutContainer(ATFolder):
         return item.get("uid", "") and True or False
 
     def get_available_positions(self):
-        """Returns a list of dics with available positions
+        """Returns a sorted list of tuples with available positions
         """
-        els = filter(self.is_empty, self.getPositionsLayout())
-        return map(lambda el: (el["row"], el["column"]), els)
+        return self.get_layout_snapshot().get_free_positions()
+
+    def get_available_positions_count(self):
+        """Returns the number of available positions
+        """
+        return self.get_layout().get_free_count()
+
+    def get_available_alpha_positions(self):
+        """Returns a list with the available positions in alphanumeric format
+        """
+        return map(lambda el: self.position_to_alpha(el[0], el[1]),
+                   self.get_available_positions())
 
     def get_non_available_positions(self):
         """Returns a list of tuples with non-available positions
@@ -274,11 +367,9 @@ class StorageLayoutContainer(ATFolder):
         """
         if not self.is_valid_position(row, column):
             return None
-        for item in self.getPositionsLayout():
-            if api.to_int(item["row"]) == api.to_int(row):
-                if api.to_int(item["column"]) == api.to_int(column):
-                    return item
-        return None
+        flush_layout_buffer()
+        snapshot = self.get_layout_snapshot()
+        return snapshot.get(api.to_int(row), api.to_int(column))
 
     def get_uid_at(self, row, column):
         """Returns a uid this container contains at the given position.
@@ -301,11 +392,7 @@ class StorageLayoutContainer(ATFolder):
         uid = api.get_uid(object_brain_uid)
         if not uid:
             return None
-        els = filter(lambda el: el.get("uid", "") == uid,
-                     self.getPositionsLayout())
-        if not els:
-            return None
-        return (api.to_int(els[0]['row']), api.to_int(els[0]['column']))
+        return self.get_layout_snapshot().get_position(uid)
 
     def has_object(self, object_brain_uid):
         """Returns if the container contains the object passed in
@@ -332,52 +419,99 @@ class StorageLayoutContainer(ATFolder):
         """Returns the first empty position of the layout as a tuple (row, col)
         If there are no empty positions, returns None
         """
-        available_positions = self.get_available_positions()
-        if not available_positions:
-            return None
-        return min(available_positions)
+        return self.get_layout_snapshot().get_first_free()
 
     def get_minimum_size(self):
         """Returns a tuple (rows, columns) that represents the minimum size this
         container can have without removing any of the objects it contains
         """
-        els = filter(self.is_taken, self.getPositionsLayout())
-        rows = map(lambda el: api.to_int(el['row']), els) or [0]
-        cols = map(lambda el: api.to_int(el['column']), els) or [0]
-        return (max(rows)+1, max(cols)+1)
+        return self.get_layout_snapshot().get_minimum_size()
 
     def get_capacity(self):
         """Returns the total number of positions available for this container
         """
         return self.getRows() * self.getColumns()
 
+    def get_fill_ratio(self):
+        """Returns the ratio (from 0 to 1) of positions that are taken
+        """
+        capacity = self.get_capacity()
+        if capacity <= 0:
+            return 1.0
+        taken = capacity - self.get_available_positions_count()
+        return round(float(taken) / capacity, 4)
+
     def is_full(self):
         """Returns if the container is full. This is, there are no empty
         positions remaining without an object in there
         """
-        return not self.get_first_empty_position()
+        return self.get_layout().is_full()
+
+    def reindex_layout(self):
+        """Reindexes the indexes and metadata that depend on the layout of the
+        container, once, right after the transaction is committed. The
+        catalog record of the container is not written by the transaction, so
+        concurrent stores into the same container do not conflict on it
+        """
+        queue_reindex(self, self.layout_indexes, deferred=True)
 
     def remove_object(self, object_brain_uid, notify_parent=True):
         """Removes the object from the container, if in there
         """
-        uid = api.get_uid(object_brain_uid)
-        if not uid:
-            return False
-        els = filter(lambda el: el.get("uid", "") != uid,
-                     self.getPositionsLayout())
-        self.setPositionsLayout(els)
-
-        if notify_parent:
+        return self.remove_objects([object_brain_uid],
+                                   notify_parent=notify_parent)[0]
+
+    def remove_objects(self, objects_brains_uids, notify_parent=True):
+        """Removes the objects from the container, if in there. The slots are
+        cleared and the parent is notified only once. Returns a list with the
+        result (True/False) of each removal, in the same order
+        """
+        results = []
+        positions = []
+        layout = self.get_layout(create=True)
+        for object_brain_uid in objects_brains_uids:
+            uid = api.get_uid(object_brain_uid)
+            if not uid:
+                results.append(False)
+                continue
+            position = layout.get_position(uid)
+            if position:
+                positions.append(position)
+            # Not in there, nothing to do
+            results.append(True)
+
+        # Only the slots the objects were stored in are cleared
+        for row, column in positions:
+            layout.clear(row, column)
+
+        if positions:
+            self.reindex_layout()
+        if positions and notify_parent:
             self.notify_parent()
-        return True
+        return results
 
     def notify_parent(self):
         """Notifies the parent to update the information it holds about this
-        container
+        container. The parent is updated only once per transaction, either
+        before the transaction is committed or when the samples usage of a
+        container is read, whatever happens first
+        """
+        parent = api.get_parent(self)
+        if IStorageLayoutContainer.providedBy(parent):
+            get_layout_buffer().mark_dirty(self)
+        elif is_rollup_node(parent):
+            get_layout_buffer().mark_dirty(self)
+
+    def update_parent(self):
+        """Updates the information the parent holds about this container. If
+        the parent is a facility or a position, the usage rollups of the parent
+        and its ancestors are updated instead
         """
         parent = api.get_parent(self)
         if IStorageLayoutContainer.providedBy(parent):
             parent.update_object(self)
+        elif is_rollup_node(parent):
+            update_usage_rollups(self)
 
     def update_object(self, object_brain_uid):
         """Updates the object from the container, if in there
@@ -385,9 +519,16 @@ class StorageLayoutContainer(ATFolder):
         position = self.get_object_position(object_brain_uid)
         if not position:
             return False
-        if not self.remove_object(object_brain_uid, notify_parent=False):
-            return False
-        return self.add_object_at(object_brain_uid, position[0], position[1])
+
+        # Only the usage of the slot is updated, in place
+        obj = api.get_object(object_brain_uid)
+        capacity, utilization = self.get_object_samples_usage(obj)
+        layout = self.get_layout(create=True)
+        if layout.set_usage(position[0], position[1], capacity, utilization):
+            # The samples usage metadata of this container changed
+            self.reindex_layout()
+            self.notify_parent()
+        return True
 
     def can_add_object(self, object_brain_uid, row, column):
         """Returns whether the object can be added to the position
@@ -438,36 +579,86 @@ class StorageLayoutContainer(ATFolder):
         """Adds an object to the specified position. If an object already exists
         at the given position, return False. Otherwise, return True
         """
-        if not self.can_add_object(object_brain_uid, row, column):
-            return False
+        return self.add_objects_at([(object_brain_uid, row, column)])[0]
+
+    def add_objects_at(self, placements):
+        """Adds the objects to the specified positions. Placements is a list of
+        tuples (object_brain_uid, row, column). All placements are validated
+        before the layout is written and the parent is notified only once.
+        Returns a list with the result (True/False) of each placement, in the
+        same order
+        """
+        results = []
+        valid = []
+        # UIDs and positions taken by the placements of this batch
+        taken = set()
+        for object_brain_uid, row, column in placements:
+            allowed = self.can_add_object(object_brain_uid, row, column)
+            uid = allowed and api.get_uid(object_brain_uid)
+            position = (api.to_int(row), api.to_int(column))
+            if allowed and (uid in taken or position in taken):
+                logger.warn("Cannot add '{}' at ({}, {}) in '{}': conflicts "
+                            "with another placement"
+                            .format(uid, row, column, self.getId()))
+                allowed = False
+            if allowed:
+                taken.update([uid, position])
+                valid.append((object_brain_uid, position))
+            results.append(allowed)
+
+        for object_brain_uid, position in valid:
+            self._set_object_at(object_brain_uid, position[0], position[1])
+
+        if valid:
+            self.reindex_layout()
+            self.notify_parent()
+        return results
 
+    def _set_object_at(self, object_brain_uid, row, column):
+        """Writes the object in the slot at the given position, without any
+        further check
+        """
         uid = api.get_uid(object_brain_uid)
         obj = api.get_object(object_brain_uid)
+        capacity, utilization = self.get_object_samples_usage(obj)
+
+        # Only the slot at the given position is written
+        item = self.get_object_layout_data(obj)
+        item.update({
+            "uid": uid,
+            "samples_capacity": capacity,
+            "samples_utilization": utilization,
+        })
+        layout = self.get_layout(create=True)
+        layout.set(row, column, item)
+
+        # The usage of containers changes with their contents, so it is kept
+        # apart to be updated in place
+        if IStorageLayoutContainer.providedBy(obj):
+            layout.set_usage(row, column, capacity, utilization)
 
+    def get_object_layout_data(self, obj):
+        """Returns a dict with the additional data of the object passed in to
+        keep in the layout item it is stored in
+        """
+        return {}
+
+    def get_object_samples_usage(self, obj):
+        """Returns a tuple (samples capacity, samples utilization) of the
+        object passed in when stored in this container. Inactive samples
+        containers do not contribute to the usage of the containers they are in
+        """
         # If the object does not implement StorageLayoutContainer, then we
         # assume the object is not a container, rather the content that needs to
         # be contained (e.g. a Sample), so we set capacity and utilization to 1
-        samples_capacity = 1
-        samples_utilization = 1
-        if IStorageLayoutContainer.providedBy(obj):
-            # This is a container, so infer the capacity and utilization
-            samples_capacity = obj.get_samples_capacity()
-            samples_utilization = obj.get_samples_utilization()
-
-        row = api.to_int(row)
-        column = api.to_int(column)
-        layout = [{'uid': uid,
-                   'row': row,
-                   'column': column,
-                   'samples_capacity': samples_capacity,
-                   'samples_utilization': samples_utilization, }]
-        for item in self.getPositionsLayout():
-            if item["row"] == row and item["column"] == column:
-                continue
-            layout.append(item.copy())
-        self.setPositionsLayout(layout)
-        self.notify_parent()
-        return True
+        if not IStorageLayoutContainer.providedBy(obj):
+            return 1, 1
+
+        if IStorageSamplesContainer.providedBy(obj) and not api.is_active(obj):
+            return 0, 0
+
+        # This is a container, so infer the capacity and utilization
+        return obj.get_samples_capacity(), obj.get_samples_utilization()
 
     def get_layout_subfield_sum(self, subfield):
         """Returns the sum of the elements stored in the layout for the subfield
@@ -480,13 +671,30 @@ class StorageLayoutContainer(ATFolder):
         """Returns the total number of samples this container can store directly
         or indirectly through contained containers
         """
-        return self.get_layout_subfield_sum(subfield="samples_capacity")
+        flush_layout_buffer()
+        return self.get_layout().get_samples_capacity()
 
     def get_samples_utilization(self):
         """Returns the total number of samples this container actually stores,
         directly or indirectly through contained containers
         """
-        return self.get_layout_subfield_sum(subfield="samples_utilization")
+        flush_layout_buffer()
+        return self.get_layout().get_samples_utilization()
+
+    def verify_samples_usage(self, repair=False):
+        """Returns whether the running totals of samples capacity and
+        utilization match with the sums of the layout items. If repair is True,
+        the totals are recomputed from the layout when they drifted
+        """
+        layout = self.get_layout(create=repair)
+        drift = layout.get_usage_drift()
+        if not drift:
+            return True
+        logger.warn("Samples usage of '{}' drifted: {}"
+                    .format(self.getId(), drift))
+        if repair:
+            layout.reindex_usage()
+        return False
 
     def is_samples_full(self):
         """Returns whether if this container actually stores the maximum number
@@ -496,35 +704,35 @@ class StorageLayoutContainer(ATFolder):
         """
         return self.get_samples_capacity() == self.get_samples_utilization()
 
+    def recompute_samples_usage(self):
+        """Recomputes the samples usage of this container from the items of
+        its layout and the usage of the containers it directly contains, that
+        are assumed to be up to date. Returns whether the usage changed
+        """
+        layout = self.get_layout(create=True)
+        before = (layout.get_samples_capacity(),
+                  layout.get_samples_utilization())
+        for obj in self.get_layout_containers():
+            position = layout.get_position(api.get_uid(obj))
+            if not position:
+                continue
+            capacity, utilization = self.get_object_samples_usage(obj)
+            layout.set_usage(position[0], position[1], capacity, utilization)
+        layout.reindex_usage()
+        after = (layout.get_samples_capacity(),
+                 layout.get_samples_utilization())
+        return before != after
+
     def reset_samples_usage(self, recursive=True):
         """Resets the sample usage values (capacity and utilization) for this
         container. It looks through all children to reset the values.
         If recursive is set to True, the function reset the samples usage for
         contained containers too.
         """
-        items = filter(self.is_taken, self.getPositionsLayout())
-        items = map(lambda item: item.get["uid"], items)
-        uids = filter(api.is_uid, items)
-        if not uids:
-            return
-
-        query = dict(UID=uids)
-        uids_usage = {}
-        for brain in api.search(query, "uid_catalog"):
-            obj = api.get_object(brain)
-            if not IStorageLayoutContainer.providedBy(obj):
-                continue
-            if recursive:
+        if recursive:
+            for obj in self.get_layout_containers():
                 obj.reset_samples_usage(recursive=recursive)
-            uids_usage[api.get_uid(obj)] = {
-                "samples_utilization": obj.get_samples_utilization(),
-                "samples_capacity": obj.get_samples_capacity() }
-
-        new_items = list()
-        for layout_item in self.getPositionsLayout():
-            item = layout_item.copy()
-            usage = uids_usage.get(item.get("uid"), None)
-            if usage:
-                item.update(usage)
-            new_items.append(item)
-        self.setPositionsLayout(new_items)
+
+        if self.recompute_samples_usage():
+            self.reindex_layout()
+            self.notify_parent()
@@ -25,6 +25,7 @@ from Products.Archetypes.atapi import registerType
 from Products.Archetypes.Schema import Schema
 from senaite.core.catalog import SAMPLE_CATALOG
 from senaite.storage import PRODUCT_NAME
+from senaite.storage.api import get_sample_locations
 from senaite.storage.content.storagelayoutcontainer import \
     StorageLayoutContainer
 from senaite.storage.content.storagelayoutcontainer import schema
@@ -40,6 +41,8 @@ class StorageSamplesContainer(StorageLayoutContainer):
     """
     implements(IStorageSamplesContainer)
     schema = schema
+    layout_indexes = ("fill_ratio", "free_positions", "get_sample_types_uids",
+                      "get_samples_uids", "is_full")
     default_samples_capacity = 1
 
     def is_object_allowed(self, object_brain_uid):
@@ -52,34 +55,64 @@ class StorageSamplesContainer(StorageLayoutContainer):
         obj = api.get_object(object_brain_uid)
         return IAnalysisRequest.providedBy(obj)
 
-    def add_object_at(self, object_brain_uid, row, column):
-        """Adds an sample to the specified position. If an object already exists
-        at the given position, return False.
+    def add_objects_at(self, placements):
+        """Adds the samples to the specified positions. Placements is a list of
+        tuples (object_brain_uid, row, column). Returns a list with the result
+        (True/False) of each placement, in the same order
         """
-        if not self.can_add_object(object_brain_uid, row, column):
-            return False
+        results = super(StorageSamplesContainer, self).add_objects_at(
+            placements)
+        samples = [placement[0] for placement, stored
+                   in zip(placements, results) if stored]
+        if not samples:
+            return results
 
-        sample = api.get_object(object_brain_uid)
-        stored = super(StorageSamplesContainer, self).add_object_at(
-            sample, row, column)
-        if not stored:
-            return False
-
-        # Transition the sample to "stored" state
+        # Transition the samples to "stored" state
         # TODO check if the sample has a container assigned in BeforeTransition
         # If it does not have a container assigned, change the workflow state
         # to the previous one automatically (integrity-check)
-        self.reindexObject(idxs=["get_samples_uids", "is_full"])
-        sample = api.get_object(sample)
-        wf.doActionFor(sample, "store")
-        return stored
+        self.update_samples_locations(samples)
+        for sample in samples:
+            sample = api.get_object(sample)
+            wf.doActionFor(sample, "store")
+        return results
+
+    def remove_objects(self, objects_brains_uids, notify_parent=True):
+        """Removes the samples from the container, if in there
+        """
+        uids = filter(self.has_object, objects_brains_uids)
+        results = super(StorageSamplesContainer, self).remove_objects(
+            objects_brains_uids, notify_parent=notify_parent)
+        if uids:
+            self.remove_samples_locations(uids)
+        return results
 
-    def remove_object(self, object_brain_uid, notify_parent=True):
-        """Removes the object from the container, if in there
+    def update_samples_locations(self, samples):
+        """Keeps the location of the samples passed in, as stored in this
+        container, in the sample locations utility
         """
-        removed = super(StorageSamplesContainer, self).remove_object(
-            object_brain_uid, notify_parent=notify_parent)
-        return removed
+        locations = get_sample_locations()
+        if locations is None:
+            return
+        uid = api.get_uid(self)
+        path = api.get_path(self)
+        layout = self.get_layout()
+        for sample in samples:
+            sample_uid = api.get_uid(sample)
+            position = layout.get_position(sample_uid)
+            if position:
+                locations.set(sample_uid, uid, position[0], position[1], path)
+
+    def remove_samples_locations(self, samples):
+        """Removes the location of the samples passed in from the sample
+        locations utility, if they are located in this container
+        """
+        locations = get_sample_locations()
+        if locations is None:
+            return
+        uid = api.get_uid(self)
+        for sample in samples:
+            locations.remove(api.get_uid(sample), uid)
 
     def has_samples(self):
         """Returns whether this sample container contains samples or not
@@ -89,8 +122,7 @@ class StorageSamplesContainer(StorageLayoutContainer):
     def get_samples_uids(self):
         """Returns the uids of the samples this container contains
         """
-        uids = map(lambda item: item.get("uid", ""), self.getPositionsLayout())
-        return filter(api.is_uid, uids)
+        return filter(api.is_uid, self.get_layout().get_uids())
 
     def get_samples(self, as_brains=False):
         samples_uids = self.get_samples_uids()
@@ -102,19 +134,48 @@ class StorageSamplesContainer(StorageLayoutContainer):
             return brains
         return map(api.get_object, brains)
 
-    # TODO Finish this (index and searches are still missing)
+    def get_object_layout_data(self, obj):
+        """Returns the sample type of the sample passed in, to keep it in the
+        layout item the sample is stored in
+        """
+        return {"sample_type_uid": obj.getRawSampleType()}
+
     def get_sample_types_uids(self):
-        """Returns the uids of the samples types of the samples this container
-        contains, if any. This is mostly used for suggest searches with
-        ZCTextIndex, that gives a higher score when the term is found more than
-        once. Hence the list may contain duplicates
+        """Returns the uids of the sample types of the samples this container
+        contains, if any. The sample types are read from the layout items, so
+        the samples are not searched
         """
-        samples_uids = self.get_samples_uids()
-        if not samples_uids:
-            return []
-        query = dict(UID=samples_uids)
-        brains = api.search(query, SAMPLE_CATALOG)
-        return map(lambda brain: brain.getSampleTypeUID, brains)
+        layout = self.get_layout()
+        uids = set()
+        for uid in self.get_samples_uids():
+            item = layout.get(*layout.get_position(uid))
+            if item.get("sample_type_uid"):
+                uids.add(item["sample_type_uid"])
+        return sorted(uids)
 
+    def reindex_sample_types(self):
+        """Stores the sample type of the stored samples in the layout items
+        they are stored in, if missing. Returns the number of items updated,
+        samples that no longer exist are left as they are
+        """
+        layout = self.get_layout(create=True)
+        positions = {}
+        for uid in self.get_samples_uids():
+            position = layout.get_position(uid)
+            if not layout.get(*position).get("sample_type_uid"):
+                positions[uid] = position
+        if not positions:
+            return 0
+        updated = 0
+        query = dict(UID=positions.keys())
+        for brain in api.search(query, SAMPLE_CATALOG):
+            if not brain.getSampleTypeUID:
+                continue
+            row, column = positions[api.get_uid(brain)]
+            item = layout.get(row, column)
+            item["sample_type_uid"] = brain.getSampleTypeUID
+            layout.set(row, column, item)
+            updated += 1
+        return updated
 
 registerType(StorageSamplesContainer, PRODUCT_NAME)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.STORAGE.
+#
+# SENAITE.STORAGE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2019-2022 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from bika.lims import api
+from plone.indexer import indexer
+from senaite.storage.api import get_storage_address_tokens
+from senaite.storage.interfaces import ISenaiteStorageCatalog
+from senaite.storage.interfaces import IStorageContent
+from senaite.storage.interfaces import IStorageUtilization
+
+
+@indexer(IStorageContent, ISenaiteStorageCatalog)
+def get_address_tokens(instance):
+    """Returns the tokens of the storage address of the storage content, so it
+    can be resolved with a single search
+    """
+    return get_storage_address_tokens(instance)
+
+
+@indexer(IStorageContent, ISenaiteStorageCatalog)
+def get_parent_uid(instance):
+    """Returns the UID of the parent of the storage content
+    """
+    return api.get_uid(api.get_parent(instance))
+
+
+@indexer(IStorageContent, ISenaiteStorageCatalog)
+def samples_capacity(instance):
+    """Returns the total samples capacity of the storage content
+    """
+    return IStorageUtilization(instance).get_samples_capacity()
+
+
+@indexer(IStorageContent, ISenaiteStorageCatalog)
+def samples_utilization(instance):
+    """Returns the total number of samples stored in the storage content
+    """
+    return IStorageUtilization(instance).get_samples_utilization()
+
+
+@indexer(IStorageContent, ISenaiteStorageCatalog)
+def samples_containers(instance):
+    """Returns the number of active samples containers within the storage
+    content
+    """
+    return IStorageUtilization(instance).get_capacity()
@@ -34,3 +34,31 @@ def listing_searchable_text(instance):
     entries.update(tokens)
     entries.update(instance.get_all_ids())
     return u" ".join(list(entries))
+
+
+@indexer(IStorageLayoutContainer, ISenaiteStorageCatalog)
+def samples_capacity(instance):
+    """Returns the total samples capacity of the container
+    """
+    return instance.get_samples_capacity()
+
+
+@indexer(IStorageLayoutContainer, ISenaiteStorageCatalog)
+def samples_utilization(instance):
+    """Returns the total number of samples stored in the container
+    """
+    return instance.get_samples_utilization()
+
+
+@indexer(IStorageLayoutContainer, ISenaiteStorageCatalog)
+def free_positions(instance):
+    """Returns the number of free positions of the container
+    """
+    return instance.get_available_positions_count()
+
+
+@indexer(IStorageLayoutContainer, ISenaiteStorageCatalog)
+def fill_ratio(instance):
+    """Returns the ratio of positions of the container that are taken
+    """
+    return instance.get_fill_ratio()
@@ -80,6 +80,25 @@ class IStorageSamplesContainer(IStorageContent):
     """
 
 
+class ISampleLocations(Interface):
+    """Utility that keeps the location of the samples stored in samples
+    containers
+    """
+
+    def get(uid, default=None):
+        """Returns a tuple (container UID, row, column) with the location of
+        the sample with the given UID
+        """
+
+    def set(uid, container_uid, row, column):
+        """Sets the location of the sample with the given UID
+        """
+
+    def remove(uid, container_uid=None):
+        """Removes the location of the sample with the given UID
+        """
+
+
 class IStorageJS(IViewletManager):
     """A viewlet manager that provides the JavaScripts for DataBox
     """
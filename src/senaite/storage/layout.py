@@ -0,0 +1,798 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.STORAGE.
+#
+# SENAITE.STORAGE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2019-2022 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import itertools
+import re
+import string
+
+import transaction
+from bika.lims import api
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
+from persistent import Persistent
+
+ALPHABET = string.ascii_uppercase
+
+ALPHA_POSITION_RE = re.compile(r"^\s*([A-Z]+)(\d+)\s*$", re.IGNORECASE)
+
+# Maximum number of layout dimensions kept in the position labels cache
+LABELS_CACHE_SIZE = 128
+
+_labels_cache = {}
+
+_marker = object()
+
+# Keys of a layout item. Any other key is additional data of the object stored
+ITEM_KEYS = ("row", "column", "uid", "samples_capacity", "samples_utilization")
+
+
+def get_row_label(row):
+    """Returns the alphabetic label of the row (A, B, ..., Z, AA, AB, ...)
+    """
+    label = ""
+    num = row + 1
+    while num > 0:
+        num, idx = divmod(num - 1, len(ALPHABET))
+        label = ALPHABET[idx] + label
+    return label
+
+
+def get_row_from_label(label):
+    """Returns the row for the alphabetic label passed in
+    """
+    num = 0
+    for char in label.upper():
+        num = num * len(ALPHABET) + ALPHABET.index(char) + 1
+    return num - 1
+
+
+def get_position_labels(rows, columns):
+    """Returns the position labels for a layout with the given dimensions. The
+    labels are computed once per dimensions and cached
+    """
+    key = (rows, columns)
+    labels = _labels_cache.get(key)
+    if labels is None:
+        if len(_labels_cache) >= LABELS_CACHE_SIZE:
+            _labels_cache.clear()
+        labels = PositionLabels(rows, columns)
+        _labels_cache[key] = labels
+    return labels
+
+
+class PositionLabels(object):
+    """Precomputed alphanumeric labels (e.g. A1, B12) of the positions of a
+    layout with the given dimensions
+    """
+
+    def __init__(self, rows, columns):
+        self.rows = rows
+        self.columns = columns
+        lead_zeros = len(str(columns)) - 1
+        self.column_format = "%0{}d".format(lead_zeros)
+        self.row_labels = tuple(map(get_row_label, range(rows)))
+        self.column_labels = tuple(
+            map(lambda col: self.column_format % (col + 1), range(columns)))
+        self._rows = dict(
+            (label, row) for row, label in enumerate(self.row_labels))
+
+    def get_row_label(self, row):
+        """Returns the alphabetic label of the row
+        """
+        if 0 <= row < self.rows:
+            return self.row_labels[row]
+        return get_row_label(row)
+
+    def get_column_label(self, column):
+        """Returns the numeric label of the column
+        """
+        if 0 <= column < self.columns:
+            return self.column_labels[column]
+        return self.column_format % (column + 1)
+
+    def to_alpha(self, row, column):
+        """Returns the position in alphanumeric format (e.g A01)
+        """
+        return self.get_row_label(row) + self.get_column_label(column)
+
+    def to_position(self, alpha):
+        """Returns the position (row, column) for the alphanumeric value passed
+        in or None if the value is not valid
+        """
+        match = ALPHA_POSITION_RE.match(alpha or "")
+        if not match:
+            return None
+        row_label, column_label = match.groups()
+        row = self._rows.get(row_label.upper())
+        if row is None:
+            row = get_row_from_label(row_label)
+        return (row, int(column_label) - 1)
+
+
+class LayoutSnapshot(object):
+    """Read-only view of a layout for the current transaction. Items, UID
+    positions and free positions are read from the layout once and kept, so
+    repeated reads do not access the layout again. The snapshot is discarded
+    as soon as the layout is written
+    """
+
+    def __init__(self, layout, txn=None, revision=None):
+        self.layout = layout
+        self.transaction = txn
+        self.revision = revision
+        self.rows = layout.rows
+        self.columns = layout.columns
+        self._items = {}
+        self._positions = {}
+        self._all_items = None
+        self._free_positions = None
+        self._first_free = _marker
+        self._minimum_size = None
+
+    def _get_item(self, row, column):
+        key = (row, column)
+        if key not in self._items:
+            self._items[key] = self.layout.get(row, column)
+        return self._items[key]
+
+    def get(self, row, column):
+        """Returns a copy of the item at the given position or None
+        """
+        item = self._get_item(row, column)
+        return item and dict(item)
+
+    def get_uid(self, row, column):
+        """Returns the UID stored at the given position or an empty string
+        """
+        item = self._get_item(row, column)
+        return item and item.get("uid") or ""
+
+    def get_position(self, uid):
+        """Returns the position (row, column) of the UID or None
+        """
+        if uid not in self._positions:
+            self._positions[uid] = self.layout.get_position(uid)
+        return self._positions[uid]
+
+    def items(self):
+        """Returns a copy of all layout items, sorted by row and column
+        """
+        if self._all_items is None:
+            self._all_items = tuple(self.layout.items())
+        return map(dict, self._all_items)
+
+    def get_free_positions(self):
+        """Returns the sorted list of free positions
+        """
+        if self._free_positions is None:
+            self._free_positions = tuple(self.layout.get_free_positions())
+        return list(self._free_positions)
+
+    def get_first_free(self):
+        """Returns the first free position (row, column) or None
+        """
+        if self._first_free is _marker:
+            self._first_free = self.layout.get_first_free()
+        return self._first_free
+
+    def get_minimum_size(self):
+        """Returns the minimum size (rows, columns) of the layout
+        """
+        if self._minimum_size is None:
+            self._minimum_size = self.layout.get_minimum_size()
+        return self._minimum_size
+
+
+class SlotUsage(Persistent):
+    """Samples capacity and utilization of a layout slot that holds a
+    container. The usage is updated in place when the contents of the container
+    change and concurrent changes are merged on conflict. The number of samples
+    containers is only kept for the usage rollups of facilities and positions
+    """
+
+    # Usages stored before the number of samples containers was kept
+    containers = 0
+
+    def __init__(self, capacity=0, utilization=0, containers=0):
+        super(SlotUsage, self).__init__()
+        self.capacity = capacity
+        self.utilization = utilization
+        if containers:
+            self.containers = containers
+
+    def change(self, capacity=0, utilization=0, containers=0):
+        """Adds the deltas passed in to the usage
+        """
+        if capacity:
+            self.capacity += capacity
+        if utilization:
+            self.utilization += utilization
+        if containers:
+            self.containers += containers
+
+    def _p_resolveConflict(self, old, committed, new):
+        """Merges the changes of two concurrent transactions by adding up the
+        deltas of both with respect to the old state
+        """
+        state = dict(new)
+        for key in ("capacity", "utilization", "containers"):
+            value = committed.get(key, 0) + new.get(key, 0) - old.get(key, 0)
+            if value or key in state:
+                state[key] = value
+        return state
+
+
+class StorageLayout(Persistent):
+    """Persistent positions layout of a storage layout container
+
+    Layout items are kept in a BTree keyed by their (row, column) position, so
+    the access to a given slot does not depend on the size of the layout. Each
+    item is a dict with the keys "row", "column", "uid", "samples_capacity"
+    and "samples_utilization", same as the records of the former
+    PositionsLayout field.
+
+    The usage of slots holding a container is kept apart in a SlotUsage, so it
+    is updated in place when the contents of the container change, without
+    rewriting the item.
+
+    A reverse index keeps the position of each stored UID, so membership and
+    position lookups do not require to walk through the items either.
+
+    Free positions are kept in a sorted set, together with a counter, so the
+    first free position, the number of free positions and whether the layout
+    is full are answered without looking at the items.
+
+    The number of objects stored in each row and column is counted, so the
+    minimum size the layout can be shrunk to is known without looking at the
+    items.
+
+    In sparse mode, only the items that differ from an empty item are kept and
+    the set of free positions is not maintained. Empty items and free
+    positions are computed on demand, so the size of the layout only depends on
+    the number of occupied positions.
+
+    Running totals of samples capacity and utilization are updated with every
+    item written, so they can be read without summing up all items.
+
+    A revision counter is increased with every write and when the contents of
+    the container change in a way the items do not reflect (e.g. a nested
+    container is deactivated), so figures derived from the layout or the
+    contents can be cached with it. Since the counter is persistent, its value
+    is rolled back together with the layout on a savepoint rollback.
+
+    All structures resolve conflicts, so concurrent transactions writing
+    different slots or updating the usage of the same slot do not conflict
+    """
+
+    # Layouts created before the sparse mode was introduced are dense
+    sparse = False
+
+    # Layouts created before the revision counter was introduced
+    _revision = None
+
+    def __init__(self, rows=0, columns=0, default_capacity=0, sparse=False):
+        super(StorageLayout, self).__init__()
+        self.rows = 0
+        self.columns = 0
+        self.default_capacity = default_capacity
+        self.sparse = sparse
+        self._items = OOBTree()
+        self._uids = OOBTree()
+        self._free = OOTreeSet()
+        self._free_count = Length()
+        self._samples_capacity = Length()
+        self._samples_utilization = Length()
+        self._usage = OOBTree()
+        self._taken_rows = OOBTree()
+        self._taken_columns = OOBTree()
+        self._revision = Length()
+        self.resize(rows, columns)
+
+    def get_snapshot(self):
+        """Returns the read-only snapshot of the layout for the current
+        transaction. The snapshot is built on first access and discarded when
+        the layout is written. It is bound to the revision of the layout too,
+        so it is not used after the writes it reflects are rolled back
+        """
+        txn = transaction.get()
+        revision = self.get_revision()
+        snapshot = getattr(self, "_v_snapshot", None)
+        if snapshot is None or snapshot.transaction is not txn or \
+                snapshot.revision != revision:
+            snapshot = LayoutSnapshot(self, txn, revision)
+            self._v_snapshot = snapshot
+        return snapshot
+
+    def invalidate_snapshot(self):
+        """Discards the snapshot of the layout, if any
+        """
+        self._v_snapshot = None
+
+    def _modified(self):
+        """Discards the snapshot and increases the revision of the layout.
+        Called on every write
+        """
+        self.invalidate_snapshot()
+        self.touch()
+
+    def get_default_item(self, row, column):
+        """Returns an empty layout item for the given position
+        """
+        return dict(row=row, column=column, uid="", samples_utilization=0,
+                    samples_capacity=self.default_capacity)
+
+    def is_default_item(self, item):
+        """Returns whether the item passed in is an empty item
+        """
+        row, column = item.get("row"), item.get("column")
+        return item == self.get_default_item(row, column)
+
+    def is_valid_position(self, row, column):
+        """Returns whether the position is within the layout dimensions
+        """
+        return 0 <= row < self.rows and 0 <= column < self.columns
+
+    def iter_positions(self):
+        """Iterates over all positions (row, column) of the layout, sorted by
+        row and column
+        """
+        return itertools.product(range(self.rows), range(self.columns))
+
+    def is_taken(self, row, column):
+        """Returns whether there is an object stored at the given position
+        """
+        item = self._items.get((row, column))
+        return bool(item and item.get("uid"))
+
+    def get(self, row, column):
+        """Returns a copy of the item at the given position or None
+        """
+        key = (row, column)
+        item = self._items.get(key)
+        if item is not None:
+            item = dict(item)
+        elif self.sparse and self.is_valid_position(row, column):
+            item = self.get_default_item(row, column)
+        else:
+            return None
+        usage = self._usage.get(key)
+        if usage is not None:
+            item["samples_capacity"] = usage.capacity
+            item["samples_utilization"] = usage.utilization
+        return item
+
+    def set(self, row, column, item):
+        """Stores a copy of the item at the given position
+        """
+        self._modified()
+        key = (row, column)
+        current = self.get(row, column)
+        was_free = current is not None and not current.get("uid")
+        was_taken = bool(current and current.get("uid"))
+        self._unindex_uid(row, column)
+        self._count_usage(current, -1)
+        if key in self._usage:
+            del self._usage[key]
+        item = dict(item, row=row, column=column)
+        if not self.sparse or not self.is_default_item(item):
+            self._items[key] = item
+        elif key in self._items:
+            # Empty items are not kept in sparse mode
+            del self._items[key]
+        self._count_usage(item, 1)
+        if item.get("uid"):
+            self._uids[item["uid"]] = key
+        self._set_free(row, column, not item.get("uid"), was_free)
+        if was_taken != bool(item.get("uid")):
+            self._count_taken(row, column, was_taken and -1 or 1)
+
+    def clear(self, row, column):
+        """Empties the item at the given position
+        """
+        self.set(row, column, self.get_default_item(row, column))
+
+    def set_usage(self, row, column, capacity, utilization):
+        """Updates the samples capacity and utilization of the item at the
+        given position in place. Returns whether the usage changed
+        """
+        key = (row, column)
+        item = self.get(row, column)
+        if item is None:
+            return False
+        capacity = api.to_int(capacity, default=0)
+        utilization = api.to_int(utilization, default=0)
+        delta_capacity = capacity - api.to_int(
+            item.get("samples_capacity"), default=0)
+        delta_utilization = utilization - api.to_int(
+            item.get("samples_utilization"), default=0)
+
+        usage = self._usage.get(key)
+        if usage is None:
+            # Kept even if unchanged, so that concurrent changes are resolved
+            usage = SlotUsage(capacity, utilization)
+            self._usage[key] = usage
+        elif delta_capacity or delta_utilization:
+            usage.change(delta_capacity, delta_utilization)
+        if not (delta_capacity or delta_utilization):
+            return False
+
+        self._modified()
+        if delta_capacity:
+            self._samples_capacity.change(delta_capacity)
+        if delta_utilization:
+            self._samples_utilization.change(delta_utilization)
+        return True
+
+    def get_position(self, uid):
+        """Returns the position (row, column) of the UID or None
+        """
+        if not uid:
+            return None
+        return self._uids.get(uid)
+
+    def get_uids(self):
+        """Returns the UIDs stored in this layout
+        """
+        return list(self._uids.keys())
+
+    def _unindex_uid(self, row, column):
+        """Removes the UID stored at the given position from the reverse index
+        """
+        item = self._items.get((row, column))
+        uid = item and item.get("uid")
+        if uid and self._uids.get(uid) == (row, column):
+            del self._uids[uid]
+
+    def _set_free(self, row, column, free, was_free):
+        """Flags the given position as free or taken
+        """
+        if free == was_free:
+            return
+        self._free_count.change(free and 1 or -1)
+        if self.sparse:
+            return
+        key = (row, column)
+        if free:
+            self._free.insert(key)
+        elif key in self._free:
+            self._free.remove(key)
+
+    def _count_taken(self, row, column, delta):
+        """Adds the delta to the number of objects stored in the row and column
+        """
+        self._taken_rows[row].change(delta)
+        self._taken_columns[column].change(delta)
+
+    def _resize_taken(self, rows, columns):
+        """Keeps a counter for every row and column of the dimensions passed
+        in. Counters are never created when objects are stored, so concurrent
+        transactions storing into the same row or column only change the
+        counters, that resolve conflicts
+        """
+        for counts, size in ((self._taken_rows, rows),
+                             (self._taken_columns, columns)):
+            for key in list(counts.keys(min=size)):
+                del counts[key]
+            for key in range(size):
+                if key not in counts:
+                    counts[key] = Length()
+
+    def _reset_taken(self):
+        """Sets the counters of all rows and columns to 0
+        """
+        self._resize_taken(self.rows, self.columns)
+        for counts in (self._taken_rows, self._taken_columns):
+            for counter in counts.values():
+                if counter():
+                    counter.set(0)
+
+    def _get_last_taken(self, counts):
+        """Returns the last row or column with objects stored or 0
+        """
+        for key in reversed(counts.keys()):
+            if counts[key]():
+                return key
+        return 0
+
+    def get_minimum_size(self):
+        """Returns a tuple (rows, columns) that represents the minimum size of
+        the layout without removing any of the objects stored
+        """
+        return (self._get_last_taken(self._taken_rows) + 1,
+                self._get_last_taken(self._taken_columns) + 1)
+
+    def reindex_taken(self):
+        """Recounts the objects stored in each row and column
+        """
+        self._modified()
+        self._reset_taken()
+        for key, item in self._items.items():
+            if item.get("uid"):
+                self._count_taken(key[0], key[1], 1)
+
+    def get_free_positions(self):
+        """Returns the sorted list of free positions
+        """
+        if not self.sparse:
+            return list(self._free.keys())
+        return filter(lambda key: not self.is_taken(*key),
+                      self.iter_positions())
+
+    def get_first_free(self):
+        """Returns the first free position (row, column) or None
+        """
+        if not self._free_count():
+            return None
+        if not self.sparse:
+            return self._free.minKey()
+        for row, column in self.iter_positions():
+            if not self.is_taken(row, column):
+                return row, column
+        return None
+
+    def get_free_count(self):
+        """Returns the number of free positions
+        """
+        return self._free_count()
+
+    def is_full(self):
+        """Returns whether there are no free positions left
+        """
+        return self.get_free_count() == 0
+
+    def reindex_free(self):
+        """Rebuilds the set of free positions from the layout items
+        """
+        self._modified()
+        self._free.clear()
+        self._free_count.set(0)
+        if self.sparse:
+            taken = filter(lambda item: item.get("uid"), self._items.values())
+            self._free_count.set(self.rows * self.columns - len(taken))
+            return
+        for key, item in self._items.items():
+            if not item.get("uid"):
+                self._set_free(key[0], key[1], True, False)
+
+    def _count_usage(self, item, sign):
+        """Adds (sign=1) or subtracts (sign=-1) the samples capacity and
+        utilization of the item to the running totals
+        """
+        if not item:
+            return
+        capacity = api.to_int(item.get("samples_capacity"), default=0)
+        utilization = api.to_int(item.get("samples_utilization"), default=0)
+        if capacity:
+            self._samples_capacity.change(sign * capacity)
+        if utilization:
+            self._samples_utilization.change(sign * utilization)
+
+    def get_samples_capacity(self):
+        """Returns the total samples capacity of the items
+        """
+        return self._samples_capacity()
+
+    def get_samples_utilization(self):
+        """Returns the total samples utilization of the items
+        """
+        return self._samples_utilization()
+
+    def touch(self):
+        """Increases the revision of the layout. Called on every write and for
+        changes of the contents of the container that the items do not reflect
+        """
+        if self._revision is None:
+            self._revision = Length()
+        self._revision.change(1)
+
+    def get_revision(self):
+        """Returns the revision of the layout
+        """
+        if self._revision is None:
+            return 0
+        return self._revision()
+
+    def get_usage_serials(self):
+        """Returns the serials of the samples usage totals and of the revision
+        counter, followed by the revision, that change every time a new usage
+        or revision is committed. Returns None if any of them was changed
+        within the current transaction
+        """
+        counters = [self._samples_capacity, self._samples_utilization]
+        if self._revision is not None:
+            counters.append(self._revision)
+        serials = []
+        for counter in counters:
+            counter._p_activate()
+            if counter._p_jar is None or counter._p_changed:
+                return None
+            serials.append(counter._p_serial)
+        if self._revision is not None:
+            serials.append(self._revision())
+        return tuple(serials)
+
+    def get_usage_drift(self):
+        """Compares the running totals with the sums of the items. Returns a
+        dict with the difference (total - sum) of each total that drifted
+        """
+        drift = {}
+        totals = (
+            ("samples_capacity", self.get_samples_capacity()),
+            ("samples_utilization", self.get_samples_utilization()),
+        )
+        for key, total in totals:
+            values = [api.to_int(item.get(key), default=0)
+                      for item in self.items()]
+            if total != sum(values):
+                drift[key] = total - sum(values)
+        return drift
+
+    def reindex_usage(self):
+        """Recomputes the running totals of samples capacity and utilization
+        from the layout items
+        """
+        self._modified()
+        self._samples_capacity.set(0)
+        self._samples_utilization.set(0)
+        for item in self.items():
+            self._count_usage(item, 1)
+
+    def reindex_uids(self):
+        """Rebuilds the reverse index of UIDs from the layout items
+        """
+        self._modified()
+        self._uids.clear()
+        for key, item in self._items.items():
+            if item.get("uid"):
+                self._uids[item["uid"]] = key
+
+    def items(self):
+        """Returns a copy of all layout items, sorted by row and column
+        """
+        keys = self._items.keys()
+        if self.sparse:
+            keys = self.iter_positions()
+        return map(lambda key: self.get(*key), keys)
+
+    def set_sparse(self, sparse):
+        """Switches the layout to sparse or dense mode
+        """
+        sparse = bool(sparse)
+        if sparse == self.sparse:
+            return
+        self._modified()
+        if sparse:
+            for key, item in list(self._items.items()):
+                if self.is_default_item(item):
+                    del self._items[key]
+            self._free.clear()
+        else:
+            for row, column in self.iter_positions():
+                if (row, column) not in self._items:
+                    item = self.get_default_item(row, column)
+                    self._items[(row, column)] = item
+                if not self.is_taken(row, column):
+                    self._free.insert((row, column))
+        self.sparse = sparse
+
+    def _get_outer_keys(self, rows, columns):
+        """Returns the keys of the stored items that are outside of the
+        dimensions passed in
+        """
+        # Rows removed
+        keys = list(self._items.keys(min=(rows,)))
+        # Columns removed from the rows kept
+        if columns < self.columns:
+            for row in range(min(rows, self.rows)):
+                keys.extend(self._items.keys(min=(row, columns),
+                                             max=(row + 1,), excludemax=True))
+        return keys
+
+    def _get_new_positions(self, rows, columns):
+        """Returns the positions that are added when resizing the layout to the
+        dimensions passed in
+        """
+        kept_rows = range(min(rows, self.rows))
+        return itertools.chain(
+            # Columns added to the rows kept
+            itertools.product(kept_rows, range(self.columns, columns)),
+            # Rows added
+            itertools.product(range(self.rows, rows), range(columns)))
+
+    def resize(self, rows, columns):
+        """Resizes the layout to the dimensions passed in. Items outside of the
+        new dimensions are discarded and the new positions get an empty item.
+        Only the positions removed or added are touched
+        """
+        if (rows, columns) == (self.rows, self.columns):
+            return
+        self._modified()
+
+        # Release the objects stored outside of the new dimensions
+        outer_keys = self._get_outer_keys(rows, columns)
+        for row, column in outer_keys:
+            self.clear(row, column)
+        self._resize_taken(rows, columns)
+
+        if self.sparse:
+            # Empty items are not kept in sparse mode
+            delta = rows * columns - self.rows * self.columns
+            if delta:
+                self._free_count.change(delta)
+                self._samples_capacity.change(delta * self.default_capacity)
+        else:
+            for row, column in outer_keys:
+                self._count_usage(self.get(row, column), -1)
+                self._set_free(row, column, False, True)
+                del self._items[(row, column)]
+            for row, column in self._get_new_positions(rows, columns):
+                self.clear(row, column)
+
+        self.rows = rows
+        self.columns = columns
+
+    def update(self, items):
+        """Replaces all layout items with the items passed in. Items with an
+        invalid position are discarded and positions without an item passed in
+        get an empty item. The additional data of the objects that were stored
+        already (e.g. the sample type of a sample) is kept, unless the items
+        passed in come with their own
+        """
+        self._modified()
+        previous = dict([(item["uid"], item) for item in self._items.values()
+                         if item.get("uid")])
+        self._items.clear()
+        self._uids.clear()
+        self._free.clear()
+        self._free_count.set(0)
+        self._samples_capacity.set(0)
+        self._samples_utilization.set(0)
+        self._usage.clear()
+        self._reset_taken()
+        if self.sparse:
+            # All positions are empty
+            size = self.rows * self.columns
+            self._free_count.set(size)
+            self._samples_capacity.set(size * self.default_capacity)
+        for record in items:
+            row = api.to_int(record.get("row"), default=-1)
+            column = api.to_int(record.get("column"), default=-1)
+            if not self.is_valid_position(row, column):
+                continue
+            uid = record.get("uid") or ""
+            item = self.get_default_item(row, column)
+            for source in (previous.get(uid) or {}, record):
+                item.update([(key, value) for key, value in source.items()
+                             if key not in ITEM_KEYS])
+            item.update({
+                "uid": uid,
+                "samples_capacity": api.to_int(
+                    record.get("samples_capacity"),
+                    default=self.default_capacity),
+                "samples_utilization": api.to_int(
+                    record.get("samples_utilization"), default=0),
+            })
+            self.set(row, column, item)
+        if self.sparse:
+            return
+        for row, column in self.iter_positions():
+            if (row, column) not in self._items:
+                self.clear(row, column)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.STORAGE.
+#
+# SENAITE.STORAGE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2019-2022 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from BTrees.OOBTree import OOBTree
+from persistent import Persistent
+from senaite.storage.interfaces import ISampleLocations
+from zope.interface import implementer
+
+
+@implementer(ISampleLocations)
+class SampleLocations(Persistent):
+    """Persistent local utility that maps the UID of each stored sample to a
+    tuple (container UID, row, column, container path) with its location
+    """
+
+    def __init__(self):
+        super(SampleLocations, self).__init__()
+        self._locations = OOBTree()
+
+    def get(self, uid, default=None):
+        """Returns the location of the sample with the given UID
+        """
+        return self._locations.get(uid, default)
+
+    def set(self, uid, container_uid, row, column, container_path=None):
+        """Sets the location of the sample with the given UID
+        """
+        location = (container_uid, row, column, container_path)
+        if self._locations.get(uid) != location:
+            self._locations[uid] = location
+
+    def remove(self, uid, container_uid=None):
+        """Removes the location of the sample with the given UID. If a
+        container UID is passed in, the location is only removed if the sample
+        is located in that container. Returns whether it was removed
+        """
+        location = self._locations.get(uid)
+        if location is None:
+            return False
+        if container_uid and location[0] != container_uid:
+            return False
+        del self._locations[uid]
+        return True
+
+    def clear(self):
+        """Removes all locations
+        """
+        self._locations.clear()
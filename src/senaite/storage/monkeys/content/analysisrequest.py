@@ -42,7 +42,7 @@ def getSamplesContainer(self):
 def getSamplesContainerID(self):
     """Returns the ID of the samples container the sample is located in
     """
-    container = getSamplesContainer(self)
+    container = _api.get_storage_sample(self)
     return container and api.get_id(container) or ""
 
 
@@ -50,5 +50,5 @@ def getSamplesContainerID(self):
 def getSamplesContainerURL(self):
     """Returns the URL of the samples container the sample is located in
     """
-    container = getSamplesContainer(self)
+    container = _api.get_storage_sample(self)
     return container and api.get_url(container) or ""
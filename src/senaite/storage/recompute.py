@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.STORAGE.
+#
+# SENAITE.STORAGE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2019-2022 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import transaction
+from bika.lims import api
+from senaite.storage import logger
+from senaite.storage.catalog import STORAGE_CATALOG
+from senaite.storage.rollup import update_usage_rollups
+from zope.annotation.interfaces import IAnnotations
+
+CHECKPOINT_KEY = "senaite.storage.recompute_samples_usage"
+
+# Number of containers processed between two commits
+CHUNK_SIZE = 500
+
+# Number of containers processed between two savepoints
+SAVEPOINT_SIZE = 100
+
+
+def get_sort_key(brain):
+    """Returns the key the container of the brain passed in is processed by.
+    Deeper containers come first, so the contents of a container are always
+    processed before the container itself
+    """
+    path = brain.getPath()
+    return (-len(path.split("/")), path)
+
+
+def get_checkpoint(portal, name=CHECKPOINT_KEY):
+    """Returns the sort key of the last container committed by a previous
+    recompute that did not finish, if any
+    """
+    checkpoint = IAnnotations(portal).get(name)
+    return checkpoint and tuple(checkpoint) or None
+
+
+def set_checkpoint(portal, key, name=CHECKPOINT_KEY):
+    """Stores the sort key of the last container processed, or removes the
+    checkpoint if key is None
+    """
+    annotations = IAnnotations(portal)
+    if key is None:
+        annotations.pop(name, None)
+    else:
+        annotations[name] = key
+
+
+def recompute_samples_usage(portal, chunk_size=CHUNK_SIZE, commit=True,
+                            restart=False):
+    """Recomputes the samples capacity and utilization of all containers, as
+    well as the usage rollups of facilities and positions, in a single pass.
+
+    Containers are processed deepest first, so each one is recomputed once,
+    from the already recomputed containers it contains. If commit is True,
+    the changes are committed in chunks and the recompute resumes from the
+    last committed container when called again, unless restart is True.
+    Returns the number of containers whose usage changed
+    """
+    query = {"portal_type": ["StorageContainer", "StorageSamplesContainer"]}
+    brains = sorted(api.search(query, STORAGE_CATALOG), key=get_sort_key)
+
+    checkpoint = not restart and get_checkpoint(portal) or None
+    if checkpoint:
+        logger.info("Resuming samples usage recompute after {}"
+                    .format(checkpoint[1]))
+        brains = filter(lambda brain: get_sort_key(brain) > checkpoint,
+                        brains)
+
+    total = len(brains)
+    changed = 0
+    for num, brain in enumerate(brains, start=1):
+        obj = api.get_object(brain)
+        if obj.recompute_samples_usage():
+            obj.reindex_layout()
+            changed += 1
+        update_usage_rollups(obj)
+
+        if num % chunk_size == 0 and commit:
+            set_checkpoint(portal, get_sort_key(brain))
+            transaction.commit()
+            logger.info("Recomputing samples usage: {}/{} (committed)"
+                        .format(num, total))
+        elif num % SAVEPOINT_SIZE == 0:
+            transaction.savepoint(optimistic=True)
+            logger.info("Recomputing samples usage: {}/{}"
+                        .format(num, total))
+        else:
+            continue
+        # Free the objects processed so far from the connection cache
+        portal._p_jar.cacheGC()
+
+    set_checkpoint(portal, None)
+    if commit:
+        transaction.commit()
+    logger.info("Recomputing samples usage: {} of {} containers changed"
+                .format(changed, total))
+    return changed
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.STORAGE.
+#
+# SENAITE.STORAGE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2019-2022 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from Acquisition import aq_base
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from bika.lims import api
+from persistent import Persistent
+from senaite.storage.buffer import queue_reindex
+from senaite.storage.catalog import STORAGE_CATALOG
+from senaite.storage.interfaces import IStorageFacility
+from senaite.storage.interfaces import IStorageLayoutContainer
+from senaite.storage.interfaces import IStoragePosition
+from senaite.storage.interfaces import IStorageSamplesContainer
+from senaite.storage.layout import SlotUsage
+
+ROLLUP_ATTR = "_usage_rollup"
+
+# Indexes reindexed when the rollup of a facility or position changes, so the
+# samples usage metadata, that is updated with any index, is kept in sync
+ROLLUP_INDEXES = ("getId",)
+
+
+class UsageRollup(Persistent):
+    """Samples usage of the storage contents within a facility or a storage
+    position, rolled up from the usage of their direct children. The totals
+    are kept in conflict-resolving counters, so concurrent changes in different
+    containers of the same facility do not conflict
+    """
+
+    def __init__(self):
+        super(UsageRollup, self).__init__()
+        self._children = OOBTree()
+        self._samples_capacity = Length()
+        self._samples_utilization = Length()
+        self._samples_containers = Length()
+
+    def get_child(self, uid):
+        """Returns the usage of the child with the given uid, if any
+        """
+        return self._children.get(uid)
+
+    def get_children_uids(self):
+        """Returns the uids of the children that contribute to the rollup
+        """
+        return list(self._children.keys())
+
+    def set_child(self, uid, capacity, utilization, containers):
+        """Sets the usage of the child with the given uid and returns the
+        deltas with respect to its previous usage
+        """
+        usage = self._children.get(uid)
+        if usage is None:
+            usage = SlotUsage()
+        deltas = (capacity - usage.capacity,
+                  utilization - usage.utilization,
+                  containers - usage.containers)
+        self.change_child(uid, *deltas)
+        return deltas
+
+    def change_child(self, uid, capacity=0, utilization=0, containers=0):
+        """Adds the deltas passed in to the usage of the child with the given
+        uid and to the totals
+        """
+        usage = self._children.get(uid)
+        if usage is None:
+            usage = SlotUsage()
+            self._children[uid] = usage
+        if not any((capacity, utilization, containers)):
+            return
+        usage.change(capacity, utilization, containers)
+        self._samples_capacity.change(capacity)
+        self._samples_utilization.change(utilization)
+        self._samples_containers.change(containers)
+
+    def remove_child(self, uid):
+        """Removes the child with the given uid and returns the deltas
+        """
+        usage = self._children.get(uid)
+        if usage is None:
+            return (0, 0, 0)
+        deltas = (-usage.capacity, -usage.utilization, -usage.containers)
+        self.change_child(uid, *deltas)
+        del self._children[uid]
+        return deltas
+
+    def get_samples_capacity(self):
+        """Returns the total samples capacity
+        """
+        return self._samples_capacity()
+
+    def get_samples_utilization(self):
+        """Returns the total number of samples
+        """
+        return self._samples_utilization()
+
+    def get_samples_containers(self):
+        """Returns the total number of samples containers
+        """
+        return self._samples_containers()
+
+
+def is_rollup_node(obj):
+    """Returns whether the object keeps a rollup of the usage of its contents
+    """
+    return IStorageFacility.providedBy(obj) or \
+        IStoragePosition.providedBy(obj)
+
+
+def get_usage_rollup(obj, create=True):
+    """Returns the usage rollup of the facility or storage position passed in.
+    The rollup is created lazily, unless create is False
+    """
+    rollup = getattr(aq_base(obj), ROLLUP_ATTR, None)
+    if rollup is None and create:
+        rollup = UsageRollup()
+        setattr(obj, ROLLUP_ATTR, rollup)
+    return rollup
+
+
+def get_top_container(container):
+    """Returns the outermost layout container the container passed in is in,
+    or the container itself if its parent is not a layout container
+    """
+    parent = api.get_parent(container)
+    while IStorageLayoutContainer.providedBy(parent):
+        container = parent
+        parent = api.get_parent(container)
+    return container
+
+
+def get_container_usage(container):
+    """Returns a tuple (capacity, utilization, containers) with the samples
+    usage the layout container contributes to the rollups of its ancestors.
+    Only active samples containers contribute, the same as in the usage of the
+    containers they are in, so the rollups match with the sum of the usage of
+    the outermost containers
+    """
+    if IStorageSamplesContainer.providedBy(container) and \
+            not api.is_active(container):
+        return (0, 0, 0)
+    query = {
+        "portal_type": "StorageSamplesContainer",
+        "review_state": "active",
+        "path": {"query": api.get_path(container)},
+    }
+    containers = len(api.search(query, STORAGE_CATALOG))
+    return (container.get_samples_capacity(),
+            container.get_samples_utilization(),
+            containers)
+
+
+def get_rollup_usage(obj):
+    """Returns a tuple (capacity, utilization, containers) with the samples
+    usage the layout container or storage position contributes to the rollups
+    of its ancestors
+    """
+    if IStorageLayoutContainer.providedBy(obj):
+        return get_container_usage(obj)
+    rollup = get_usage_rollup(obj, create=False)
+    if rollup is None:
+        return (0, 0, 0)
+    return (rollup.get_samples_capacity(),
+            rollup.get_samples_utilization(),
+            rollup.get_samples_containers())
+
+
+def is_contained(obj, parent):
+    """Returns whether the object is still contained in the parent passed in
+    """
+    contained = parent._getOb(api.get_id(obj), None)
+    return aq_base(contained) is aq_base(obj)
+
+
+def update_usage_rollups(obj):
+    """Updates the usage rollups of the facility and positions the layout
+    container or storage position is in, if any
+    """
+    parent = api.get_parent(obj)
+    if not is_rollup_node(parent):
+        return
+    if not is_contained(obj, parent):
+        # Removed or moved away in the meantime
+        return
+    usage = get_rollup_usage(obj)
+    rollup = get_usage_rollup(parent)
+    deltas = rollup.set_child(api.get_uid(obj), *usage)
+    if any(deltas):
+        queue_reindex(parent, ROLLUP_INDEXES, deferred=True)
+    propagate_usage_rollups(parent, deltas)
+
+
+def remove_from_usage_rollups(obj, parent):
+    """Removes the layout container or storage position from the usage rollups
+    of the parent passed in and its ancestors
+    """
+    if not is_rollup_node(parent):
+        return
+    rollup = get_usage_rollup(parent, create=False)
+    if rollup is None:
+        return
+    deltas = rollup.remove_child(api.get_uid(obj))
+    if any(deltas):
+        queue_reindex(parent, ROLLUP_INDEXES, deferred=True)
+    propagate_usage_rollups(parent, deltas)
+
+
+def propagate_usage_rollups(node, deltas):
+    """Adds the deltas to the usage rollups of the ancestors of the node
+    """
+    if not any(deltas):
+        return
+    parent = api.get_parent(node)
+    while is_rollup_node(parent):
+        get_usage_rollup(parent).change_child(api.get_uid(node), *deltas)
+        queue_reindex(parent, ROLLUP_INDEXES, deferred=True)
+        node = parent
+        parent = api.get_parent(node)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.STORAGE.
+#
+# SENAITE.STORAGE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2019-2022 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+"""Checks the consistency of the samples stored in the storage containers of a
+site and writes a JSON report.
+
+Run it with the instance script, e.g.:
+
+    bin/instance run \
+        src/senaite.storage/src/senaite/storage/scripts/check_storage_consistency.py \
+        --site senaite --workers 4 --output report.json
+
+The containers are checked by worker processes with their own connections to
+the database, so the database must be served by ZEO or alike. With --repair,
+the issues that can be repaired safely are repaired and committed.
+"""
+
+import argparse
+import json
+import sys
+
+import transaction
+from AccessControl.SecurityManagement import newSecurityManager
+from senaite.storage.consistency import CHUNK_SIZE
+from senaite.storage.consistency import check_storage_consistency
+from senaite.storage.consistency import repair_storage_consistency
+from senaite.storage.consistency import supports_multiple_clients
+from Testing.makerequest import makerequest
+from zope.component.hooks import setSite
+
+
+def get_arguments(argv):
+    """Returns the arguments passed in to the script, without those of the
+    instance script itself
+    """
+    if "-c" in argv:
+        argv = argv[argv.index("-c") + 2:]
+    else:
+        argv = argv[1:]
+    parser = argparse.ArgumentParser(
+        description="Checks the consistency of storage containers")
+    parser.add_argument("-s", "--site", default="senaite",
+                        help="Id of the site (default: senaite)")
+    parser.add_argument("-u", "--user", default="admin",
+                        help="User to run the check as (default: admin)")
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="Number of worker processes (default: 0)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="Containers per worker task (default: {})"
+                        .format(CHUNK_SIZE))
+    parser.add_argument("-o", "--output", default="-",
+                        help="File to write the report to (default: stdout)")
+    parser.add_argument("--repair", action="store_true",
+                        help="Repair the issues that can be repaired safely")
+    return parser.parse_args(argv)
+
+
+def main(app, argv):
+    args = get_arguments(argv)
+    app = makerequest(app)
+    portal = app[args.site]
+    setSite(portal)
+
+    acl_users = app.acl_users
+    user = acl_users.getUser(args.user)
+    if user is None:
+        sys.exit("User '{}' not found".format(args.user))
+    newSecurityManager(None, user.__of__(acl_users))
+
+    if args.workers and not supports_multiple_clients(portal):
+        sys.exit("Worker processes require a storage that supports multiple "
+                 "clients (e.g. ZEO)")
+
+    report = check_storage_consistency(portal, workers=args.workers,
+                                       chunk_size=args.chunk_size)
+    if args.repair:
+        report["repaired"] = repair_storage_consistency(portal, report)
+        transaction.commit()
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output == "-":
+        sys.stdout.write(output + "\n")
+    else:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main(app, sys.argv)  # noqa: F821
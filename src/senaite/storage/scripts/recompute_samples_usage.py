@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.STORAGE.
+#
+# SENAITE.STORAGE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2019-2022 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+"""Recomputes the samples usage of all storage containers of a site.
+
+Run it with the instance script, e.g.:
+
+    bin/instance run \
+        src/senaite.storage/src/senaite/storage/scripts/recompute_samples_usage.py \
+        --site senaite
+
+The changes are committed in chunks. If the run is interrupted, running the
+script again resumes from the last committed chunk, unless --restart is set.
+"""
+
+import argparse
+import sys
+
+from AccessControl.SecurityManagement import newSecurityManager
+from senaite.storage.recompute import CHUNK_SIZE
+from senaite.storage.recompute import recompute_samples_usage
+from Testing.makerequest import makerequest
+from zope.component.hooks import setSite
+
+
+def get_arguments(argv):
+    """Returns the arguments passed in to the script, without those of the
+    instance script itself
+    """
+    if "-c" in argv:
+        argv = argv[argv.index("-c") + 2:]
+    else:
+        argv = argv[1:]
+    parser = argparse.ArgumentParser(
+        description="Recomputes the samples usage of storage containers")
+    parser.add_argument("-s", "--site", default="senaite",
+                        help="Id of the site (default: senaite)")
+    parser.add_argument("-u", "--user", default="admin",
+                        help="User to run the recompute as (default: admin)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="Containers per commit (default: {})"
+                        .format(CHUNK_SIZE))
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore the checkpoint of a previous run")
+    return parser.parse_args(argv)
+
+
+def main(app, argv):
+    args = get_arguments(argv)
+    app = makerequest(app)
+    portal = app[args.site]
+    setSite(portal)
+
+    acl_users = app.acl_users
+    user = acl_users.getUser(args.user)
+    if user is None:
+        sys.exit("User '{}' not found".format(args.user))
+    newSecurityManager(None, user.__of__(acl_users))
+
+    recompute_samples_usage(portal, chunk_size=args.chunk_size,
+                            restart=args.restart)
+
+
+if __name__ == "__main__":
+    main(app, sys.argv)  # noqa: F821
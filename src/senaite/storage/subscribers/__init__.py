@@ -18,9 +18,17 @@
 # Copyright 2019-2022 by it's authors.
 # Some rights reserved, see README and LICENSE.
 
+from Acquisition import aq_base
 from bika.lims import api
 from senaite.storage import logger
+from senaite.storage.adapters.utilization import invalidate_utilization
+from senaite.storage.api import update_storage_addresses
 from senaite.storage.interfaces import IStorageLayoutContainer
+from senaite.storage.interfaces import IStorageSamplesContainer
+from senaite.storage.rollup import is_rollup_node
+from senaite.storage.rollup import remove_from_usage_rollups
+from senaite.storage.rollup import update_usage_rollups
+from zope.lifecycleevent.interfaces import IContainerModifiedEvent
 
 
 def StorageContentModifiedEventHandler(container, event):
@@ -46,6 +54,11 @@ def StorageContentModifiedEventHandler(container, event):
     fired.
     """
     parent = api.get_parent(container)
+    if is_rollup_node(parent):
+        # Update the usage rollups of the facility and positions
+        container.notify_parent()
+        return
+
     if not IStorageLayoutContainer.providedBy(parent):
         # Parent doesn't care about the changes in his children
         return
@@ -65,6 +78,10 @@ def StorageContentModifiedEventHandler(container, event):
 def StorageContentRemovedEventHandler(container, event):
     """Removes the object from parent's layout (if the parent is a container)
     """
+    if IStorageSamplesContainer.providedBy(container):
+        # Samples are no longer located in this container
+        container.remove_samples_locations(container.get_samples_uids())
+
     parent = api.get_parent(container)
     if not IStorageLayoutContainer.providedBy(parent):
         return
@@ -73,3 +90,48 @@ def StorageContentRemovedEventHandler(container, event):
         logger.warn("Cannot remove the container '{}' from '{}'"
                     .format(container.getId(), parent.getId()))
 
+
+def StorageContentMovedEventHandler(obj, event):
+    """Updates the usage rollups of the facilities and positions the layout
+    container or storage position was moved out or removed from, as well as
+    the rollups of those it was moved into. Additions are handled on modified
+    """
+    moved = event.oldParent is not None and event.newParent is not None
+    if moved and IStorageSamplesContainer.providedBy(obj):
+        # The path of the container is kept in the location of its samples
+        obj.update_samples_locations(obj.get_samples_uids())
+
+    if aq_base(event.object) is not aq_base(obj):
+        # Event dispatched to the contents of the moved object
+        return
+
+    if IStorageLayoutContainer.providedBy(obj):
+        # The cached utilization of the containers it was and is in changes
+        invalidate_utilization(event.oldParent)
+        invalidate_utilization(event.newParent)
+
+    if event.oldParent is not None:
+        remove_from_usage_rollups(obj, event.oldParent)
+
+    if event.oldParent is None or event.newParent is None:
+        # Added or removed
+        return
+
+    if IStorageLayoutContainer.providedBy(obj):
+        obj.notify_parent()
+    else:
+        update_usage_rollups(obj)
+
+
+def StorageContentAddressModifiedEventHandler(obj, event):
+    """Reindexes the storage address of the storage contents within the object
+    if its title changed, because their address contains the title of the
+    object. Moved and renamed objects are reindexed together with their
+    contents by the catalog
+    """
+    if IContainerModifiedEvent.providedBy(event):
+        # Objects added or removed, the title did not change
+        return
+    # Reindexed right away, so the new address resolves within the same
+    # transaction. Title changes are rare, so there is no need to defer it
+    update_storage_addresses(obj)
@@ -18,14 +18,30 @@
 # Copyright 2019-2022 by it's authors.
 # Some rights reserved, see README and LICENSE.
 
+import transaction
+from Acquisition import aq_base
+from bika.lims import api
 from senaite.core.upgrade import upgradestep
 from senaite.core.upgrade.utils import UpgradeUtils
 from senaite.storage import logger
 from senaite.storage import PRODUCT_NAME
+from senaite.storage.api import get_sample_locations
+from senaite.storage.catalog import STORAGE_CATALOG
+from senaite.storage.interfaces import IStorageSamplesContainer
+from senaite.storage.recompute import CHUNK_SIZE
+from senaite.storage.recompute import get_checkpoint
+from senaite.storage.recompute import get_sort_key
+from senaite.storage.recompute import SAVEPOINT_SIZE
+from senaite.storage.recompute import set_checkpoint
+from senaite.storage.rollup import ROLLUP_ATTR
+from senaite.storage.rollup import update_usage_rollups
+from senaite.storage.setuphandlers import setup_catalogs
 
 version = "2.4.0"
 profile = "profile-{0}:default".format(PRODUCT_NAME)
 
+CHECKPOINT_KEY = "senaite.storage.upgrade.v02_04_000"
+
 
 @upgradestep(PRODUCT_NAME, version)
 def upgrade(tool):
@@ -46,3 +62,86 @@ def upgrade(tool):
 
     logger.info("{0} upgraded to version {1}".format(PRODUCT_NAME, version))
     return True
+
+
+def convert_storage_contents(tool):
+    """Converts the storage contents to the data structures of this version in
+    a single walk through the containers, deepest first:
+
+    - the records of the PositionsLayout field are moved to the persistent
+      layout, with all its indexes and counters
+    - the samples usage of the containers and the usage rollups of facilities
+      and storage positions are computed
+    - the sample type and location of stored samples are indexed
+    - the new catalog indexes and metadata columns are filled
+
+    The changes are committed in chunks and the conversion resumes from the
+    last committed container when the step is run again
+    """
+    portal = tool.aq_inner.aq_parent
+    setup = portal.portal_setup
+    setup_catalogs(portal)
+    setup.runImportStepFromProfile(profile, "componentregistry")
+
+    checkpoint = get_checkpoint(portal, name=CHECKPOINT_KEY)
+    if not checkpoint:
+        get_sample_locations().clear()
+
+    logger.info("Indexing storage facilities and positions ...")
+    query = {"portal_type": ["StorageFacility", "StoragePosition"]}
+    for brain in api.search(query, STORAGE_CATALOG):
+        obj = api.get_object(brain)
+        if not checkpoint and getattr(aq_base(obj), ROLLUP_ATTR, None):
+            delattr(obj, ROLLUP_ATTR)
+        obj.reindexObject(idxs=["get_address_tokens"])
+    logger.info("Indexing storage facilities and positions [DONE]")
+
+    query = {"portal_type": ["StorageContainer", "StorageSamplesContainer"]}
+    brains = sorted(api.search(query, STORAGE_CATALOG), key=get_sort_key)
+    if checkpoint:
+        logger.info("Resuming conversion of containers after {}"
+                    .format(checkpoint[1]))
+        brains = filter(lambda brain: get_sort_key(brain) > checkpoint,
+                        brains)
+
+    total = len(brains)
+    for num, brain in enumerate(brains, start=1):
+        obj = api.get_object(brain)
+        convert_container(obj)
+
+        if num % CHUNK_SIZE == 0:
+            set_checkpoint(portal, get_sort_key(brain), name=CHECKPOINT_KEY)
+            transaction.commit()
+            logger.info("Converting containers: {}/{} (committed)"
+                        .format(num, total))
+        elif num % SAVEPOINT_SIZE == 0:
+            transaction.savepoint(optimistic=True)
+            logger.info("Converting containers: {}/{}".format(num, total))
+        else:
+            continue
+        # Free the objects processed so far from the connection cache
+        portal._p_jar.cacheGC()
+
+    set_checkpoint(portal, None, name=CHECKPOINT_KEY)
+    logger.info("Converting containers [DONE]")
+
+
+def convert_container(obj):
+    """Converts the storage layout container passed in. The containers it
+    contains must be converted already
+    """
+    if "AvailablePositions" in obj.__dict__:
+        # Computed from the layout now
+        delattr(obj, "AvailablePositions")
+
+    # Moves the records of the PositionsLayout field to the layout, if not
+    # done yet, and computes the usage from the contained containers
+    obj.get_layout(create=True)
+    obj.recompute_samples_usage()
+
+    if IStorageSamplesContainer.providedBy(obj):
+        obj.reindex_sample_types()
+        obj.update_samples_locations(obj.get_samples_uids())
+
+    update_usage_rollups(obj)
+    obj.reindexObject(idxs=["get_address_tokens"] + list(obj.layout_indexes))
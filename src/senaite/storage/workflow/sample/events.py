@@ -25,6 +25,11 @@ from bika.lims.utils import changeWorkflowState
 from bika.lims.workflow import doActionFor as do_action_for
 from senaite.core.workflow import SAMPLE_WORKFLOW
 from senaite.storage import api as _api
+from senaite.storage.buffer import queue_reindex
+
+# Indexes of the sample that depend on its storage. The metadata (e.g. the
+# container the sample is stored in) is updated together with them
+SAMPLE_STORAGE_INDEXES = ("getDateStored",)
 
 
 def before_dispatch(sample):
@@ -68,8 +73,9 @@ def after_recover(sample):
     changeWorkflowState(sample, SAMPLE_WORKFLOW, previous_state)
     resume_snapshots_for(sample)
 
-    # Reindex the sample
-    sample.reindexObject()
+    # Reindex the storage information of the sample. The workflow-related
+    # indexes were already reindexed on the workflow state change
+    queue_reindex(sample, SAMPLE_STORAGE_INDEXES)
 
     # If the sample is a partition, try to promote to the primary
     primary = sample.getParentAnalysisRequest()
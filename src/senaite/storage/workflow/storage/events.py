@@ -20,8 +20,11 @@
 
 from bika.lims import api
 from senaite.storage import logger
+from senaite.storage.adapters.utilization import invalidate_utilization
 from senaite.storage.api import get_parents
+from senaite.storage.interfaces import IStorageLayoutContainer
 from senaite.storage.interfaces import IStorageRootFolder
+from senaite.storage.rollup import get_top_container
 
 PROGRESS_FLAG = "_v_progress"
 
@@ -46,6 +49,9 @@ def after_activate(obj):
         # toggle progress flag off
         toggle_in_progress(obj, False)
 
+    # update the usage rollups of the facility and positions
+    notify_usage_changed(obj)
+
 
 def after_deactivate(obj):
     """Event triggered after "deactivate" transition
@@ -67,6 +73,23 @@ def after_deactivate(obj):
         # toggle progress flag off
         toggle_in_progress(obj, False)
 
+    # update the usage rollups of the facility and positions
+    notify_usage_changed(obj)
+
+
+def notify_usage_changed(obj):
+    """Flags the container, so the usage of the slot it is stored in is updated,
+    and the outermost container the object is in, so the usage rollups of the
+    facility and positions are updated with the number of active samples
+    containers. Invalidates the cached utilization of the containers the
+    object is in
+    """
+    if not IStorageLayoutContainer.providedBy(obj):
+        return
+    invalidate_utilization(obj)
+    obj.notify_parent()
+    get_top_container(obj).notify_parent()
+
 
 def toggle_in_progress(obj, toggle):
     """toggle the progress flag on the object